@@ -1,38 +1,58 @@
+import os
 import pprint
 import time
 import threading
+import pandas as pd
 import panel as pn
 from panel.viewable import Viewer
-from lib.game import Avalon
+from lib.metrics import serve_metrics
+from lib.room import RoomManager
 
 pn.extension(notifications=True, sizing_mode='stretch_both')
 nickname = pn.widgets.StaticText(name='player', value='')
+room_id = pn.widgets.StaticText(name='room', value='')
 pn.state.location.sync(nickname, {'value': 'nickname'})
-if 'nicknames' not in pn.state.cache:
-    pn.state.cache['nicknames'] = []
-    pn.state.cache['admin'] = None
-    pn.state.cache['avalon'] = None
-    pn.state.cache['members'] = []
-    pn.state.cache['assassin_target'] = None
-    pn.state.cache['lake_lady_target'] = None
-    pn.state.cache['timer'] = 20
+pn.state.location.sync(room_id, {'value': 'room'})
+if 'rooms' not in pn.state.cache:
+    pn.state.cache['rooms'] = RoomManager()
+    # bring back the games that were running before the server restarted
+    pn.state.cache['rooms'].recover_rooms('log', time_budget=10)
+    # metrics for our scraper at http://127.0.0.1:9464/metrics, in Prometheus text format
+    try:
+        serve_metrics(pn.state.cache['rooms'], port=int(os.environ.get('AVALON_METRICS_PORT', 9464)))
+    except OSError as e:
+        print(f'Metrics endpoint is not started: {e}')
+rooms = pn.state.cache['rooms']
 
 template = pn.template.BootstrapTemplate(title='Welcome to Avalon')
 app = pn.Column()
+session_id = pn.state.curdoc.session_context.id if pn.state.curdoc and pn.state.curdoc.session_context else None
 
 
-def watch_game(avalon):
-    while True:
-        avalon.api_server_run()
-        if avalon.end_game or not pn.state.cache['avalon']:
-            return
+def enter_room(room):
+    """
+    To count this browser session in the room (see lib.metrics.render_metrics()) until the session is closed.
+    """
+    for other in rooms.list_rooms():
+        other.sessions.discard(session_id)
+    room.sessions.add(session_id)
+
+
+def leave_rooms(session_context):
+    for room in rooms.list_rooms():
+        room.sessions.discard(session_context.id)
+
+
+if session_id is not None:
+    pn.state.on_session_destroyed(leave_rooms)
 
 
 class MainPage(Viewer):
     def __init__(self, **params):
         super().__init__(**params)
         self.stop = None
-        self.avalon = pn.state.cache['avalon']
+        self.room = rooms.get_room(room_id.value)
+        self.avalon = self.room.avalon
         self.nickname = pn.widgets.StaticText(name='Nickname', value=nickname.value)
         self.stage = pn.widgets.StaticText(name='Stage', value=self.avalon.game_param['stage'])
         self.leader = pn.widgets.StaticText(name='Leader', value=self.avalon.game_param['leader'])
@@ -50,7 +70,7 @@ class MainPage(Viewer):
         self.nickname_buttons = [pn.widgets.Button(name=n,
                                                    button_type=self.get_nickname_button_type(n),
                                                    disabled=True) for n in self.avalon.p_positions]
-        self.timer = pn.indicators.Number(name='Timer', value=pn.state.cache['timer'], visible=False)
+        self.timer = pn.indicators.Number(name='Timer', value=self.room.timer, visible=False)
         self.lake_lady_btn = pn.widgets.Button(name='Select', visible=False)
         self.speak_btn = pn.widgets.Button(name='Start Speak', visible=False)
         self.propose_btn = pn.widgets.Button(name='Propose', visible=False)
@@ -61,6 +81,13 @@ class MainPage(Viewer):
         self.game_info_btn = pn.widgets.Button(name='Show Game Info', button_type='warning')
         self.player_info_btn = pn.widgets.Button(name='Show Player Info', button_type='warning')
         self.record_btn = pn.widgets.Button(name='Show Records', button_type='warning')
+        # game records of this player, new rounds are streamed into the table as they are recorded
+        self.records_table = pn.widgets.Tabulator(
+            pd.DataFrame(self.avalon.get_game_record_rows(nickname.value),
+                         columns=self.avalon.records_renderer.get_field_names(nickname.value)),
+            disabled=True,
+            show_index=False)
+        self.n_records_shown = len(self.avalon.history)
         self.ai_btn = pn.widgets.Button(name='trigger ai move', button_type='danger', visible=False)
         self.debug_btn = pn.widgets.Button(name='debug', button_type='danger')
 
@@ -76,28 +103,43 @@ class MainPage(Viewer):
             if self.avalon.game_param['members']:
                 target = self.avalon.game_param['members']
             else:
-                target = pn.state.cache['members']
+                target = self.room.members
         elif self.avalon.game_param['stage'] == 'lake_lady':
-            target = [pn.state.cache['lake_lady_target']]
+            target = [self.room.lake_lady_target]
         elif self.avalon.game_param['stage'] == 'end' and self.avalon.game_param['win_3_quests'] == 'good':
-            target = [pn.state.cache['assassin_target']]
+            target = [self.room.assassin_target]
         if n in target:
             return 'primary'
         else:
             return 'default'
 
+    def act(self, action, *args):
+        """
+        To queue an action of this player to the actor of the room (see Room.submit()), instead of changing the game
+        from this session's thread. Return the Future of the action's result, failures are printed.
+        """
+        player = nickname.value
+        future = self.room.submit(action, player, *args)
+
+        def report(f):
+            if f.exception() is not None:
+                print(f'{player}, {action} failed: {f.exception()}')
+
+        future.add_done_callback(report)
+        return future
+
     def lake_lady_btn_click(self, event):
-        if pn.state.cache['lake_lady_target']:
-            self.avalon.use_lake_lady_power(nickname.value, pn.state.cache['lake_lady_target'])
+        if self.room.lake_lady_target:
+            self.act('use_lake_lady_power', self.room.lake_lady_target)
             pn.state.notifications.clear()
-            pn.state.notifications.success(f"You have picked {pn.state.cache['lake_lady_target']} and he is on "
-                                           f"{self.avalon.players_info[pn.state.cache['lake_lady_target']]['side']} "
+            pn.state.notifications.success(f"You have picked {self.room.lake_lady_target} and he is on "
+                                           f"{self.avalon.players_info[self.room.lake_lady_target]['side']} "
                                            f"side.",
                                            duration=4000)
-            pn.state.cache['lake_lady_target'] = None
+            self.room.lake_lady_target = None
 
         else:
-            self.avalon.use_lake_lady_power(nickname.value, None)
+            self.act('use_lake_lady_power', None)
             pn.state.notifications.clear()
             pn.state.notifications.success(f'You decided not to use your power.', duration=4000)
 
@@ -105,40 +147,40 @@ class MainPage(Viewer):
         self.stop = False
         t = self.timer.value
         while t >= 0:
-            pn.state.cache['timer'] = t
+            self.room.timer = t
             self.timer.value = t
             time.sleep(1)
             t -= 1
             if self.stop:
-                pn.state.cache['timer'] = 20
+                self.room.timer = 20
                 break
 
     def speak_btn_click(self, event):
         if self.speak_btn.name == 'End Speak':
             self.stop = True
-            self.avalon.end_speak(nickname.value)
+            self.act('end_speak')
             self.speak_btn.name = 'Start Speak'
             self.speak_btn.disabled = True
-            pn.state.cache['timer'] = 20
+            self.room.timer = 20
         else:
             self.speak_btn.name = 'End Speak'
             self.stop = False
-            thread = threading.Thread(target=self.timer_countdown)
+            thread = threading.Thread(target=self.timer_countdown, name=f'timer-{self.room.room_id}', daemon=True)
             thread.start()
 
     def nickname_btn_click(self, event):
         if self.avalon.game_param['stage'] in ['speak', 'proposal']:
             if event.obj.button_type == 'default':
-                if len(pn.state.cache['members']) < self.avalon.game_param['n_members']:
+                if len(self.room.members) < self.avalon.game_param['n_members']:
                     event.obj.button_type = 'primary'
-                    pn.state.cache['members'].append(event.obj.name)
+                    self.room.members.append(event.obj.name)
                 else:
                     pn.state.notifications.clear()
                     pn.state.notifications.error(f"You have selected more than {self.avalon.game_param['n_members']}",
                                                  duration=4000)
             else:
                 event.obj.button_type = 'default'
-                pn.state.cache['members'].remove(event.obj.name)
+                self.room.members.remove(event.obj.name)
         elif self.avalon.game_param['stage'] in ['lake_lady', 'end']:
             if event.obj.button_type == 'default':
 
@@ -146,21 +188,21 @@ class MainPage(Viewer):
                     btn.button_type = 'default'
                 event.obj.button_type = 'primary'
                 if self.avalon.game_param['stage'] == 'lake_lady':
-                    pn.state.cache['lake_lady_target'] = event.obj.name
+                    self.room.lake_lady_target = event.obj.name
                 else:
-                    pn.state.cache['assassin_target'] = event.obj.name
+                    self.room.assassin_target = event.obj.name
 
             else:
                 event.obj.button_type = 'default'
                 if self.avalon.game_param['stage'] == 'lake_lady':
-                    pn.state.cache['lake_lady_target'] = None
+                    self.room.lake_lady_target = None
                 else:
-                    pn.state.cache['assassin_target'] = None
+                    self.room.assassin_target = None
 
     def propose_btn_click(self, event):
-        if pn.state.cache['members'] and len(pn.state.cache['members']) == self.avalon.game_param['n_members']:
-            self.avalon.propose_quest(nickname.value, pn.state.cache['members'])
-            pn.state.cache['members'] = []
+        if self.room.members and len(self.room.members) == self.avalon.game_param['n_members']:
+            self.act('propose_quest', list(self.room.members))
+            self.room.members = []
         else:
             pn.state.notifications.clear()
             pn.state.notifications.error(f"Please select {self.avalon.game_param['n_members']} members!",
@@ -169,16 +211,16 @@ class MainPage(Viewer):
     def vote_btn_click(self, event):
         for btn in self.vote_buttons:
             btn.disabled = True
-        self.avalon.vote_quest(nickname.value, event.obj.name)
+        self.act('vote_quest', event.obj.name)
 
     def attempt_btn_click(self, event):
-        self.avalon.do_quest(nickname.value, event.obj.name)
+        self.act('do_quest', event.obj.name)
         for btn in self.attempt_buttons:
             btn.disabled = True
 
     def assassinate_btn_click(self, event):
-        if pn.state.cache['assassin_target']:
-            self.avalon.assassinate(nickname.value, pn.state.cache['assassin_target'])
+        if self.room.assassin_target:
+            self.act('assassinate', self.room.assassin_target)
             self.assassinate_btn.disabled = True
         else:
             pn.state.notifications.clear()
@@ -186,7 +228,7 @@ class MainPage(Viewer):
                                          duration=4000)
 
     def new_game_btn_click(self, event):
-        pn.state.cache['avalon'] = None
+        self.room.close_game()
         app.clear()
         app.append(WaitPage(nickname=nickname.value))
         self.callback.stop()
@@ -198,12 +240,14 @@ class MainPage(Viewer):
         print(self.avalon.show_players_info(nickname.value))
 
     def record_btn_click(self, event):
-        print(self.avalon.show_game_records(nickname))
+        print(self.avalon.show_game_records(nickname.value))
 
     def auto_callback(self):
-        if not pn.state.cache['avalon']:
+        if self.room.avalon is not self.avalon:
             app.clear()
             app.append(WaitPage(nickname=nickname.value))
+            self.callback.stop()
+            return
         self.stage.value = self.avalon.game_param['stage']
         self.leader.value = self.avalon.game_param['leader']
         for i in range(5):
@@ -219,11 +263,15 @@ class MainPage(Viewer):
                 self.round_buttons[i].button_type = 'primary'
             else:
                 self.round_buttons[i].button_type = 'default'
-        if nickname.value == pn.state.cache['admin']:
+        if len(self.avalon.history) > self.n_records_shown:
+            rows = self.avalon.get_game_record_rows(nickname.value, start=self.n_records_shown)
+            self.records_table.stream(pd.DataFrame(rows, columns=self.records_table.value.columns))
+            self.n_records_shown += len(rows)
+        if nickname.value == self.room.admin:
             self.new_game_btn.visible = True
 
         if self.avalon.game_param['stage'] == 'lake_lady':
-            if not pn.state.cache['lake_lady_target']:
+            if not self.room.lake_lady_target:
                 for btn in self.nickname_buttons:
                     btn.button_type = 'default'
             for btn in self.vote_buttons + self.attempt_buttons:
@@ -237,7 +285,7 @@ class MainPage(Viewer):
                 self.lake_lady_btn.visible = True
 
             if self.avalon.game_param['lake_lady'] in self.avalon.ai_nicknames and \
-                    nickname.value == pn.state.cache['admin']:
+                    nickname.value == self.room.admin:
                 self.ai_btn.visible = True
             else:
                 self.ai_btn.visible = False
@@ -247,7 +295,7 @@ class MainPage(Viewer):
             for btn in self.vote_buttons + self.attempt_buttons + [self.lake_lady_btn]:
                 btn.visible = False
             # if new round init nickname buttons
-            if all(len(n) == 0 for n in [self.avalon.game_param['members'], pn.state.cache['members']]):
+            if all(len(n) == 0 for n in [self.avalon.game_param['members'], self.room.members]):
                 for btn in self.nickname_buttons:
                     btn.button_type = 'default'
             for btn in self.nickname_buttons:
@@ -265,7 +313,7 @@ class MainPage(Viewer):
                 else:
                     self.speak_btn.visible = False
                 self.timer.visible = True
-                self.timer.value = pn.state.cache['timer']
+                self.timer.value = self.room.timer
 
             else:
                 self.speak_btn.visible = False
@@ -273,7 +321,7 @@ class MainPage(Viewer):
                 if nickname.value == self.avalon.game_param['leader']:
                     self.propose_btn.visible = True
                 if self.avalon.game_param['leader'] in self.avalon.ai_nicknames and \
-                        nickname.value == pn.state.cache['admin']:
+                        nickname.value == self.room.admin:
                     self.ai_btn.visible = True
                 else:
                     self.ai_btn.visible = False
@@ -309,7 +357,7 @@ class MainPage(Viewer):
                     else:
                         btn.disabled = False
             if all(n in self.avalon.ai_nicknames for n in self.avalon.game_param['members']) and \
-                    nickname.value == pn.state.cache['admin']:
+                    nickname.value == self.room.admin:
                 self.ai_btn.visible = True
             else:
                 self.ai_btn.visible = False
@@ -318,7 +366,7 @@ class MainPage(Viewer):
             for btn in self.attempt_buttons:
                 btn.visible = False
             if self.avalon.game_param['win_3_quests'] == 'good':
-                if not pn.state.cache['assassin_target']:
+                if not self.room.assassin_target:
                     for btn in self.nickname_buttons:
                         btn.button_type = 'default'
                 if nickname.value == self.avalon.game_param['assassin']:
@@ -329,19 +377,21 @@ class MainPage(Viewer):
                             btn.disabled = False
                     self.assassinate_btn.visible = True
                 if self.avalon.game_param['assassin'] in self.avalon.ai_nicknames and \
-                        nickname.value == pn.state.cache['admin']:
+                        nickname.value == self.room.admin:
                     self.ai_btn.visible = True
                 else:
                     self.ai_btn.visible = False
 
     def debug_btn_click(self, event):
-        pprint.pprint(self.avalon.game_param)
+        pprint.pprint(self.avalon.game_param.as_dict())
 
     def ai_btn_click(self, event):
-        self.avalon.trigger_ai_move(nickname.value)
+        self.act('trigger_ai_move')
 
     def __panel__(self):
-        self.callback = pn.state.add_periodic_callback(self.auto_callback, 1000, start=True)
+        self.callback = pn.state.add_periodic_callback(rooms.metrics.latency.timed('auto_callback', self.auto_callback),
+                                                       1000,
+                                                       start=True)
         self.lake_lady_btn.on_click(self.lake_lady_btn_click)
         self.speak_btn.on_click(self.speak_btn_click)
         self.propose_btn.on_click(self.propose_btn_click)
@@ -376,6 +426,7 @@ class MainPage(Viewer):
                          self.game_info_btn,
                          self.player_info_btn,
                          self.record_btn,
+                         self.records_table,
                          self.ai_btn,
                          self.debug_btn)
 
@@ -386,17 +437,32 @@ class JoinPage(Viewer):
         self.welcome_msg = pn.panel("<marquee>Welcome to Avalon Game</marquee>",
                                     style={'font-size': '24pt'})
         self.nickname_input = pn.widgets.TextInput(placeholder='Please type your nickname here...')
+        self.room_input = pn.widgets.TextInput(value=room_id.value,
+                                               placeholder='Room id to join, leave it blank to open a new room...')
+        self.lobby = pn.pane.Markdown(self.show_lobby())
         self.join_button = pn.widgets.Button(name='Join game', button_type='primary')
 
+    def show_lobby(self):
+        lines = [f"- {room.room_id}: {', '.join(room.nicknames)}{' (playing)' if room.avalon else ''}"
+                 for room in rooms.list_rooms()]
+        return '\n'.join(['**Rooms**'] + lines) if lines else 'No room yet, be the first one!'
+
     def join_button_click(self, event):
         error_msg = self.validate_nickname()
+        if not error_msg:
+            if self.room_input.value:
+                room = rooms.get_or_create_room(self.room_input.value)
+            else:
+                room = rooms.create_room()
+            if self.nickname_input.value in room.nicknames:
+                error_msg = 'This nickname has been used, please try again.'
         self.notification(error_msg)
         if not error_msg:
-            if not pn.state.cache['nicknames']:
-                pn.state.cache['admin'] = self.nickname_input.value
-            pn.state.cache['nicknames'].append(self.nickname_input.value)
+            room.join(self.nickname_input.value)
+            enter_room(room)
             global nickname
             nickname.value = self.nickname_input.value
+            room_id.value = room.room_id
             app.clear()
             app.append(WaitPage(nickname=self.nickname_input.value))
 
@@ -404,8 +470,6 @@ class JoinPage(Viewer):
         error_msg = None
         if self.nickname_input.value == '':
             error_msg = 'Nickname cannot be blank, please try again.'
-        elif self.nickname_input.value in pn.state.cache['nicknames']:
-            error_msg = 'This nickname has been used, please try again.'
         return error_msg
 
     def notification(self, error_msg):
@@ -422,18 +486,19 @@ class JoinPage(Viewer):
 
     def __panel__(self):
         self.join_button.on_click(self.join_button_click)
-        return pn.Column(self.welcome_msg, self.nickname_input, self.join_button)
+        return pn.Column(self.welcome_msg, self.nickname_input, self.room_input, self.join_button, self.lobby)
 
 
 class WaitPage(Viewer):
     def __init__(self, **params):
         super().__init__(**params)
 
-        self.is_admin = True if params['nickname'] == pn.state.cache['admin'] else False
+        self.room = rooms.get_room(room_id.value)
+        self.is_admin = True if params['nickname'] == self.room.admin else False
         self.n_ai_slider = pn.widgets.IntSlider(name='Number of AI players', start=0, end=9, value=0)
         self.players_cbg = pn.widgets.CheckButtonGroup(name='Players',
                                                        value=[],
-                                                       options=pn.state.cache['nicknames'],
+                                                       options=self.room.nicknames,
                                                        button_type='success',
                                                        disabled=False if self.is_admin else True)
         self.start_game_btn = pn.widgets.Button(name='start game', button_type='success', align='start')
@@ -446,17 +511,12 @@ class WaitPage(Viewer):
 
     def start_game_btn_click(self, event):
         try:
-            avalon = Avalon(pn.state.cache['nicknames'],
-                            has_percival=self.has_percival_cbox.value,
-                            has_morgana=self.has_morgana_cbox.value,
-                            has_mordred=self.has_mordred_cbox.value,
-                            has_oberon=self.has_oberon_cbox.value,
-                            has_lake_lady=self.has_lake_lady_cbox.value,
-                            n_ai=self.n_ai_slider.value,
-                            platform='api')
-            pn.state.cache['avalon'] = avalon
-            thread = threading.Thread(target=watch_game, args=(pn.state.cache['avalon'],))
-            thread.start()
+            self.room.start_game(has_percival=self.has_percival_cbox.value,
+                                 has_morgana=self.has_morgana_cbox.value,
+                                 has_mordred=self.has_mordred_cbox.value,
+                                 has_oberon=self.has_oberon_cbox.value,
+                                 has_lake_lady=self.has_lake_lady_cbox.value,
+                                 n_ai=self.n_ai_slider.value)
             # avalon.game_param['leader'] = nickname.value
             app.clear()
             app.append(MainPage)
@@ -484,10 +544,13 @@ class WaitPage(Viewer):
 
 
 pn.state.location.sync(nickname, {'value': 'nickname'})
+pn.state.location.sync(room_id, {'value': 'room'})
 app.clear()
 
-if nickname.value in pn.state.cache['nicknames']:
-    if pn.state.cache['avalon']:
+current_room = rooms.get_room(room_id.value)
+if current_room and nickname.value in current_room.nicknames:
+    enter_room(current_room)
+    if current_room.avalon:
         app.append(MainPage)
     else:
         app.append(WaitPage(nickname=nickname.value))
@@ -0,0 +1,351 @@
+"""
+Benchmark the hot paths of the game engine (lib/game.py) and compare the results with a stored baseline.
+
+Measured separately:
+- init: construction of Avalon for 5 to 10 players, with and without special roles, on both platforms
+- api_server_run: latency of an engine pass for each stage of the 'api' platform (Panel UI)
+- socket: client_run and get_msg_pack calls per second on the 'socket' platform
+- render: show_game_records and show_players_info as the game history grows
+- full_game: wall time of a whole 'api' game with computer players
+- logging: engine pass latency and wall time of whole 'api' games with the event log on
+
+Games are played with seeded random players. Only the 'logging' benchmarks write an event log (to a temporary
+directory), the others are played without one so only the engine is measured.
+
+Results are written as JSON and compared with the baseline next to this file, benchmark_baseline.json for a full run
+or benchmark_baseline_quick.json for a --quick one, as the two modes measure different workloads and are never compared
+with each other. Timings on a shared machine drift with CPU frequency and other processes, so the whole suite runs
+several rounds and the median of the rounds is taken for each benchmark. A result is reported as a regression if it is
+slower than the baseline by more than the tolerance and, for the 'us' results, by more than the minimum effect in us.
+A baseline is only meaningful on the machine it was saved on, so save a new one (--save-baseline) from the main branch
+before comparing on another machine.
+
+eg:
+python benchmark.py                          # run and compare with the baseline
+python benchmark.py --out result.json        # also write the results to a file
+python benchmark.py --save-baseline          # run and store the results as the new baseline
+python benchmark.py --quick                  # fewer repeats, for a quick check against the quick baseline
+python benchmark.py --rounds 5               # more rounds, for a noisy machine
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from prettytable import PrettyTable
+from lib.game import Avalon
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+QUICK_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline_quick.json')
+HUMANS = ['ann', 'bea', 'cat']
+ROLE_OPTIONS = {
+    'base': {},
+    'roles': dict(has_percival=True, has_morgana=True, has_lake_lady=True)
+}
+
+
+def median_us(timings):
+    return round(statistics.median(timings) * 1e6, 2)
+
+
+def act(avalon, r):
+    """
+    To make one action for the human players of an 'api' game, picking at random with r, or ask the computer players to
+    move if no human needs to act. Return False once the game is over.
+    """
+    gp = avalon.game_param
+    stage = gp.stage
+    if stage == 'end':
+        if gp.win_3_quests == 'good' and gp.assassin_target is None and gp.assassin in HUMANS:
+            avalon.assassinate(gp.assassin, r.choice(list(gp.p_good)))
+            return True
+        if gp.assassin_success is not None or gp.win_3_quests == 'evil':
+            return False
+    elif stage == 'lake_lady' and gp.lake_lady in HUMANS:
+        avalon.use_lake_lady_power(gp.lake_lady, r.choice(list(gp.p_no_lake_lady) + [None]))
+        return True
+    elif stage == 'speak' and gp.speaker:
+        avalon.end_speak(gp.speaker)
+        return True
+    elif stage == 'proposal' and gp.leader in HUMANS and not gp.members:
+        avalon.propose_quest(gp.leader, r.sample(avalon.nicknames, gp.n_members))
+        return True
+    elif stage == 'vote':
+        todo = [h for h in HUMANS if h in gp.p_no_vote]
+        if todo:
+            avalon.vote_quest(todo[0], r.choice(avalon.vote_cards))
+            return True
+    elif stage == 'quest':
+        todo = [h for h in HUMANS if h in gp.p_no_attempt]
+        if todo:
+            attempt = 'success' if todo[0] in gp.p_good else r.choice(avalon.quest_cards)
+            avalon.do_quest(todo[0], attempt)
+            return True
+    avalon.trigger_ai_move(HUMANS[0])
+    return True
+
+
+def play_api_game(seed, n_ai, on_pass=None, on_step=None, max_steps=3000, log_dir=None):
+    """
+    To play a whole 'api' game with 3 random human players and n_ai computer players.
+    on_pass(avalon, stage, seconds) is called after every engine pass that had something to handle, on_step(avalon)
+    after every action.
+    """
+    avalon = Avalon(HUMANS.copy(), n_ai=n_ai, has_lake_lady=seed % 2 == 1, has_percival=seed % 2 == 0,
+                    platform='api', log_dir=log_dir, seed=seed)
+    r = random.Random(seed)
+    for _ in range(max_steps):
+        stage = avalon.game_param.stage
+        pending = avalon.revision != avalon.handled_revision
+        start = time.perf_counter()
+        avalon.api_server_run()
+        elapsed = time.perf_counter() - start
+        if pending and on_pass:
+            on_pass(avalon, stage, elapsed)
+        if not act(avalon, r):
+            break
+        if on_step:
+            on_step(avalon)
+    return avalon
+
+
+def bench_init(repeat):
+    results = {}
+    for platform_ in ['api', 'socket']:
+        for n_players in range(5, 11):
+            for option, settings in ROLE_OPTIONS.items():
+                nicknames = [f'p{i}' for i in range(n_players)]
+                timings = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    Avalon(nicknames, platform=platform_, log_dir=None, seed=i, **settings)
+                    timings.append(time.perf_counter() - start)
+                results[f'init/{platform_}/{n_players}p/{option}'] = (median_us(timings), 'us')
+    return results
+
+
+def bench_api_stages(n_games):
+    timings = {}
+
+    def on_pass(avalon, stage, seconds):
+        timings.setdefault(str(stage), []).append(seconds)
+
+    for seed in range(n_games):
+        play_api_game(seed, n_ai=2 + seed % 6, on_pass=on_pass)
+    return dict((f'api_server_run/{stage}', (median_us(t), 'us')) for stage, t in sorted(timings.items()))
+
+
+def bench_socket(n_games):
+    client_timings = []
+    pack_timings = []
+    for seed in range(n_games):
+        avalon = Avalon(HUMANS[:2], n_ai=3 + seed % 6, platform='socket', log_dir=None, seed=seed)
+        r = random.Random(seed)
+        inputs = dict((n, None) for n in HUMANS[:2])
+        choices = [str(i) for i in range(10)] + ['x', '0 1', '1 2', '0 1 2', '2 3 4', '0 1 2 3']
+        for _ in range(3000):
+            for nickname in HUMANS[:2]:
+                start = time.perf_counter()
+                msg = avalon.client_run(nickname, inputs[nickname])
+                client_timings.append(time.perf_counter() - start)
+                inputs[nickname] = r.choice(choices) if msg else None
+                start = time.perf_counter()
+                avalon.get_msg_pack(nickname)
+                pack_timings.append(time.perf_counter() - start)
+            avalon.server_step()
+            if avalon.end_game:
+                break
+    return {
+        'socket/client_run': (round(len(client_timings) / sum(client_timings)), 'ops/s'),
+        'socket/get_msg_pack': (round(len(pack_timings) / sum(pack_timings)), 'ops/s')
+    }
+
+
+def bench_render(n_games, repeat):
+    timings = {}
+
+    def on_step(avalon):
+        n_rows = len(avalon.history)
+        if n_rows in timings or n_rows == 0:
+            return
+        records = []
+        players = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            avalon.show_game_records(HUMANS[0])
+            records.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            avalon.show_players_info(HUMANS[0])
+            players.append(time.perf_counter() - start)
+        timings[n_rows] = (records, players)
+
+    results = {}
+    for seed in range(n_games):
+        timings.clear()
+        play_api_game(seed, n_ai=2, on_step=on_step)
+        for n_rows, (records, players) in timings.items():
+            results.setdefault(f'render/show_game_records/{n_rows:02d}rows', []).extend(records)
+            results.setdefault(f'render/show_players_info/{n_rows:02d}rows', []).extend(players)
+    # history as long as only a few games have is too noisy to compare
+    return dict((k, (median_us(v), 'us')) for k, v in sorted(results.items()) if len(v) >= 5 * repeat)
+
+
+def bench_full_game(n_games):
+    results = {}
+    for n_ai in [2, 4, 7]:
+        timings = []
+        for seed in range(n_games):
+            # best of 3 runs of the same game, a whole game is long enough to be hit by other processes
+            runs = []
+            for _ in range(3):
+                start = time.perf_counter()
+                play_api_game(seed, n_ai=n_ai)
+                runs.append(time.perf_counter() - start)
+            timings.append(min(runs))
+        results[f'full_game/{3 + n_ai}p'] = (median_us(timings), 'us')
+    return results
+
+
+def bench_logging(n_games):
+    """
+    The event log is written by a background thread, this measures what is left on the engine thread: the latency of
+    an engine pass and the wall time of a whole game, without waiting for the writer at the end.
+    """
+    pass_timings = []
+    results = {}
+
+    def on_pass(avalon, stage, seconds):
+        pass_timings.append(seconds)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        for n_ai in [2, 7]:
+            timings = []
+            for seed in range(n_games):
+                start = time.perf_counter()
+                avalon = play_api_game(seed, n_ai=n_ai, on_pass=on_pass, log_dir=log_dir)
+                timings.append(time.perf_counter() - start)
+                avalon.close_log()
+            results[f'logging/full_game/{3 + n_ai}p'] = (median_us(timings), 'us')
+    results['logging/api_server_run'] = (median_us(pass_timings), 'us')
+    return results
+
+
+def run_all(quick=False):
+    repeat = 20 if quick else 200
+    n_games = 15 if quick else 60
+    results = {}
+    # the engine prints every action, keep it out of the way
+    with contextlib.redirect_stdout(io.StringIO()):
+        # warm up the caches of the engine (input validators, call plans...) before measuring
+        for seed in range(3):
+            play_api_game(seed, n_ai=2)
+        results.update(bench_init(repeat))
+        results.update(bench_api_stages(n_games))
+        results.update(bench_socket(max(n_games // 3, 2)))
+        results.update(bench_render(max(n_games // 3, 2), repeat))
+        results.update(bench_full_game(n_games))
+        results.update(bench_logging(max(n_games // 3, 2)))
+    return dict((name, {'value': value, 'unit': unit}) for name, (value, unit) in results.items())
+
+
+def run_rounds(rounds, quick=False):
+    """
+    To run the whole suite several times and take the median of the rounds for each benchmark, so one round slowed
+    down (or sped up) by other processes does not decide the result.
+    """
+    values = {}
+    units = {}
+    for _ in range(rounds):
+        for name, result in run_all(quick).items():
+            values.setdefault(name, []).append(result['value'])
+            units[name] = result['unit']
+    return dict((name, {'value': round(statistics.median(v), 2), 'unit': units[name]}) for name, v in values.items())
+
+
+def compare(results, baseline, tolerance, min_effect=0.0):
+    """
+    To compare the results with the baseline. Return the table to print and the names of regressed benchmarks.
+    Lower is better for 'us', higher is better for 'ops/s'. A 'us' result also has to be slower than the baseline by
+    more than min_effect us, so a change of a fraction of a us on a tiny benchmark is not reported.
+    """
+    table = PrettyTable(['benchmark', 'unit', 'baseline', 'current', 'change'])
+    table.align['benchmark'] = 'l'
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or not base['value']:
+            table.add_row([name, result['unit'], '-', result['value'], 'new'])
+            continue
+        change = result['value'] / base['value'] - 1
+        if result['unit'] == 'us':
+            slower = change > tolerance and result['value'] - base['value'] > min_effect
+        else:
+            slower = change < -tolerance / (1 + tolerance)
+        if slower:
+            regressions.append(name)
+        table.add_row([name, result['unit'], base['value'], result['value'], f"{change:+.1%}{' !' if slower else ''}"])
+    return table, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Avalon engine and compare with the baseline.')
+    parser.add_argument('--out', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='baseline JSON file to compare with, default is the full or the quick baseline next to '
+                             'this file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before reporting a regression')
+    parser.add_argument('--min-effect', type=float, default=2.0,
+                        help='smallest slowdown in us of a "us" result that is reported as a regression')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='n of times to run the suite, the median of each benchmark is kept')
+    parser.add_argument('--quick', action='store_true', help='fewer repeats, for a quick check')
+    args = parser.parse_args()
+    if args.baseline is None:
+        args.baseline = QUICK_BASELINE if args.quick else BASELINE
+
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'quick': args.quick,
+            'rounds': args.rounds
+        },
+        'results': run_rounds(args.rounds, args.quick)
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(output, f, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=4)
+        print(f'Baseline saved to {args.baseline}')
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved['meta'].get('quick', False) != args.quick:
+            mode = 'quick' if saved['meta'].get('quick', False) else 'full'
+            print(f"{args.baseline} is a {mode} baseline, it could not be compared with a "
+                  f"{'quick' if args.quick else 'full'} run.")
+            sys.exit(2)
+        baseline = saved['results']
+    table, regressions = compare(output['results'], baseline, args.tolerance, args.min_effect)
+    print(table)
+    if regressions:
+        print(f"{len(regressions)} benchmarks are slower than the baseline by more than {args.tolerance:.0%}: "
+              f"{', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
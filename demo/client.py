@@ -0,0 +1,95 @@
+"""
+Terminal client of the Avalon socket server (server.py).
+
+Type the answer to the game messages, '?game', '?player' or '?history' for help, or a command:
+/create [-percival] [-morgana] [-mordred] [-oberon] [-lake_lady] [-all] [-ai N]   # admin only, start the game
+/quit
+
+eg:
+python client.py --room r1 --nickname ann
+python client.py --host 10.0.0.2 --port 1235 --room r1 --nickname bob
+"""
+import argparse
+import asyncio
+import sys
+from lib.protocol import ProtocolError, encode_frame, read_frame
+
+ROLES = ['percival', 'morgana', 'mordred', 'oberon', 'lake_lady']
+
+
+def parse_create(line):
+    """
+    To parse a '/create' command into the 'create' message, e.g. '/create -percival -morgana -ai 2'.
+    """
+    words = line.split()[1:]
+    settings = dict((f'has_{r}', '-all' in words or f'-{r}' in words) for r in ROLES)
+    n_ai = 0
+    if '-ai' in words:
+        i = words.index('-ai')
+        if i + 1 >= len(words) or not words[i + 1].isdigit():
+            raise Exception('Please give the number of computer players, e.g. /create -ai 2')
+        n_ai = int(words[i + 1])
+    return {'type': 'create', 'settings': settings, 'n_ai': n_ai}
+
+
+async def receive(reader):
+    while True:
+        message = await read_frame(reader)
+        if message['type'] == 'error':
+            print(f"Error: {message['msg']}")
+        else:
+            print(message['msg'])
+        if message.get('input'):
+            print('> ', end='', flush=True)
+
+
+async def write(writer):
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line or line.strip() == '/quit':
+            return
+        line = line.strip()
+        if line.startswith('/create'):
+            try:
+                message = parse_create(line)
+            except Exception as e:
+                print(e)
+                continue
+        else:
+            message = {'type': 'input', 'input': line}
+        writer.write(encode_frame(message))
+        await writer.drain()
+
+
+async def run(host, port, room, nickname):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_frame({'type': 'join', 'room': room, 'nickname': nickname}))
+    await writer.drain()
+    tasks = [asyncio.create_task(receive(reader)), asyncio.create_task(write(writer))]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if isinstance(task.exception(), ProtocolError):
+                print(f'Error: {task.exception()}')
+            elif task.exception() and not isinstance(task.exception(), asyncio.IncompleteReadError):
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+    print('Disconnected.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play Avalon on a socket server from the terminal.')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the server')
+    parser.add_argument('--port', type=int, default=1235, help='port of the server')
+    parser.add_argument('--room', required=True, help='room to join')
+    parser.add_argument('--nickname', required=True, help='your nickname in the room')
+    args = parser.parse_args()
+    asyncio.run(run(args.host, args.port, args.room, args.nickname))
+
+
+if __name__ == '__main__':
+    main()
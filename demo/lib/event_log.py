@@ -0,0 +1,183 @@
+"""
+Append-only event log of a game, one JSON object per line (JSONL) and one file per game.
+
+Besides the actions, the game state is logged as 'delta' records (only the keys that have changed) with a full
+'snapshot' record every now and then, see StateLogger and rebuild_state().
+
+The game only puts small records (an action, a summary of an engine pass, copies of the state parameters it has changed)
+in a bounded queue, a background thread serializes them, works out the state deltas and writes them to the file, so no
+serialization or file I/O happens on the hot path. If the queue is full, the game waits for the writer instead of losing
+records.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+
+def copy_value(value):
+    """
+    To copy a state parameter for the writer thread, so the game could go on changing it. Dicts are copied, and other
+    containers (lists, pools, deques...) are copied as lists, the plain values in them are shared.
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, dict):
+        return dict((k, copy_value(v)) for k, v in value.items())
+    return [copy_value(v) for v in value]
+
+
+class EventLog:
+    def __init__(self, path, max_queue=10000, snapshot_every=50):
+        self.path = path
+        log_dir = os.path.dirname(path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.state_logger = StateLogger(snapshot_every)
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name=f'event-log-{os.path.basename(path)}', daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        """
+        To queue a record (a dict that could be serialized to JSON) for writing, the time is added as 't'.
+        """
+        record['t'] = round(time.time(), 3)
+        self.queue.put(record)
+
+    def write_state(self, revision, state, keys):
+        """
+        To queue the state parameters of the given keys (those that have changed since the last call) of the state
+        (a mapping) at the revision. The writer thread turns them into a 'snapshot' or 'delta' record, see StateLogger.
+        """
+        self.write({
+            'event': 'state',
+            'revision': revision,
+            'changes': dict((k, copy_value(state[k])) for k in keys if k in state),
+            'removed': [k for k in keys if k not in state]
+        })
+
+    def run(self):
+        """
+        To write queued records to the file. All records that are already waiting are written in one go before
+        flushing the file, so a busy game does not flush after every record.
+        """
+        with open(self.path, 'a', encoding='utf-8') as log:
+            stop = False
+            while not stop:
+                records = [self.queue.get()]
+                while True:
+                    try:
+                        records.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for record in records:
+                    # None is put by self.close() to stop the writer
+                    if record is None:
+                        stop = True
+                        continue
+                    if record['event'] == 'state':
+                        t = record['t']
+                        record = self.state_logger.get_record(record['revision'], record['changes'], record['removed'])
+                        if record is None:
+                            continue
+                        record['t'] = t
+                    log.write(json.dumps(record, default=list) + '\n')
+                log.flush()
+                for _ in records:
+                    self.queue.task_done()
+
+    def flush(self):
+        """
+        To block until all queued records are written to the file.
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        To write all queued records and stop the writer thread.
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+
+
+class StateLogger:
+    """
+    To log the game state as deltas, i.e. only the keys that have changed since the previously logged revision, plus a
+    full snapshot every 'snapshot_every' revisions. With rebuild_state(), the state at any logged revision could be
+    rebuilt from the latest snapshot before it and the deltas after that snapshot.
+
+    It runs on the writer thread of EventLog and keeps its own copy of the logged state, the game only hands over the
+    parameters it has changed (see EventLog.write_state()).
+    """
+    def __init__(self, snapshot_every=50):
+        self.snapshot_every = snapshot_every
+        self.state = {}  # the logged state
+        self.encoded = {}  # JSON of each key in the logged state
+        self.snapshot_revision = None
+
+    def get_record(self, revision, changes, removed=()):
+        """
+        To compare the changed parameters with the logged ones and return a 'snapshot' or 'delta' record, or None if
+        nothing has actually changed.
+        """
+        changed = {}
+        for k, v in changes.items():
+            encoded = json.dumps(v, default=list, sort_keys=True)
+            if self.encoded.get(k) != encoded:
+                self.state[k] = changed[k] = v
+                self.encoded[k] = encoded
+        removed = [k for k in removed if k in self.state]
+        for k in removed:
+            del self.state[k]
+            del self.encoded[k]
+
+        if self.snapshot_revision is None or revision - self.snapshot_revision >= self.snapshot_every:
+            self.snapshot_revision = revision
+            return {
+                'event': 'snapshot',
+                'revision': revision,
+                'state': dict(self.state)
+            }
+        if not changed and not removed:
+            return None
+        record = {
+            'event': 'delta',
+            'revision': revision,
+            'changes': changed
+        }
+        if removed:
+            record['removed'] = removed
+        return record
+
+
+def read_log(path):
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            if line.strip():
+                yield json.loads(line)
+
+
+def rebuild_state(path, revision=None):
+    """
+    To rebuild the game state at the given revision (or the last one if None) from the event log of a game.
+    Return the state as a dict, or None if there is no state logged at or before the revision.
+    """
+    state = None
+    for record in read_log(path):
+        if record['event'] not in ['snapshot', 'delta']:
+            continue
+        # state records are only written by the engine, so they are in order of revision
+        if revision is not None and record['revision'] > revision:
+            break
+        if record['event'] == 'snapshot':
+            state = record['state']
+        elif record['event'] == 'delta' and state is not None:
+            state.update(record['changes'])
+            for key in record.get('removed', []):
+                state.pop(key, None)
+    return state
@@ -11,21 +11,84 @@ Change Log:
 - Add help messages for players to check the updated game info
 - Add log file features
 """
+import functools
 import inspect
+import os
 import pprint
 import random
 import re
-import copy
+import threading
+import time
+import uuid
 from prettytable import PrettyTable
-
-
-def display_user_label(nickname, target):
-    if target == nickname:
-        return target + '(You)'
-    return target
+from lib.event_log import EventLog, read_log
+from lib.history import GameHistory
+from lib.knowledge import Knowledge
+from lib.metrics import LatencyMetrics
+from lib.render import RecordsRenderer, RenderCache
+from lib.state import GameState, Pool, SeatRing, Stage, Tally
+
+
+@functools.lru_cache(maxsize=None)
+def get_input_validator(n_options, n_picks=1, allow_skip=False):
+    """
+    To get the compiled re pattern for validating player's input. Patterns are cached by the number of options, the
+    number of picks and if 'x' (skip) is allowed, so they are shared by all games with the same setting.
+
+    For single pick, the input is one index of the options (or 'x' if allow_skip), e.g. '1'.
+    For multiple picks, the input is n_picks different indices separated by a space, e.g. '0 3 4'.
+
+    Note that the pattern is matched against the stripped input plus a trailing space.
+    """
+    if n_picks > 1:
+        return re.compile(r'^(?!.*(.\s).*\1)([0-' + f'{n_options - 1}' + r']\s){' + f'{n_picks}' + r'}$')
+    return re.compile(r'^[0-' + f'{n_options - 1}' + ('x' if allow_skip else '') + r']\s*$')
+
+
+def parse_input(validator, input_):
+    """
+    To validate player's input with a pattern from get_input_validator().
+    Return the list of picked indices, where None stands for 'x', or None if the input is not valid.
+    """
+    input_ = input_.strip()
+    if not validator.match(input_ + ' '):
+        return None
+    return [None if i == 'x' else int(i) for i in input_.split()]
+
+
+class MsgPacks(dict):
+    """
+    Message packs of each stage (see Avalon.gen_msg_packs()). The packs of a stage are generated by its builder on
+    first access and kept afterwards.
+    """
+    def __init__(self, builders):
+        super().__init__()
+        self.builders = builders
+
+    def __missing__(self, stage):
+        msg_packs = self.builders[stage]()
+        self[stage] = msg_packs
+        return msg_packs
 
 
 class Avalon:
+    # action methods that could be replayed from the event log, see self.replay()
+    replay_actions = ('end_speak',
+                      'propose_quest',
+                      'vote_quest',
+                      'do_quest',
+                      'assassinate',
+                      'use_lake_lady_power',
+                      'trigger_ai_move')
+    # engine steps that are timed when the game is instrumented, see self.instrument()
+    timed_steps = ('handle_lake_lady',
+                   'handle_proposal',
+                   'handle_vote',
+                   'handle_quest',
+                   'handle_end',
+                   'move_next_stage',
+                   'move_next_round')
+
     def __init__(self,
                  nicknames,
                  has_percival=False,
@@ -34,10 +97,15 @@ class Avalon:
                  has_oberon=False,
                  has_lake_lady=False,
                  n_ai=None,
-                 platform='socket'):
-        self.stages = ['init', 'proposal', 'vote', 'quest', 'record', 'end']
+                 platform='socket',
+                 log_dir='log',
+                 game_id=None,
+                 deal=None,
+                 seed=None,
+                 instrument=False):
+        self.stages = [Stage.INIT, Stage.PROPOSAL, Stage.VOTE, Stage.QUEST, Stage.RECORD, Stage.END]
         if platform == 'api':
-            self.stages = ['speak', 'proposal', 'vote', 'quest', 'end']
+            self.stages = [Stage.SPEAK, Stage.PROPOSAL, Stage.VOTE, Stage.QUEST, Stage.END]
         self.vote_cards = ['approve', 'reject']
         self.quest_cards = ['success', 'fail']
         self.good_character_cards = ['merlin', 'percival', 'loyal servant']
@@ -55,12 +123,25 @@ class Avalon:
                                  'n_fail',
                                  'quest_result']
         self.end_game = None
+        # 'deal' is the 'setup' record of a logged game, its computer players, seats and characters are used instead of
+        # dealing new ones, see Avalon.recover()
+        self.deal = deal
+        # Every game owns its random generator, so a game could be played again with the same seed. If no seed is
+        # given, a new one is picked and recorded in the event log.
+        # The deal is drawn even if it is given, so the generator of a recovered game goes on from the same state as
+        # the one of the logged game.
+        self.seed = seed if seed is not None else random.SystemRandom().getrandbits(64)
+        self.random = random.Random(self.seed)
         self.human_nicknames = nicknames
         self.nicknames = nicknames
         self.ai_nicknames = []
+        if deal:
+            n_ai = len(deal['ai_nicknames'])
         if n_ai:
             dummy_names = ['Allan', 'Bob', 'Curtis', 'Danny', 'Evan', 'Frank', 'Gibson', 'Harry', 'Issac', 'Jake']
-            self.ai_nicknames = random.sample([n for n in dummy_names if n not in self.nicknames], n_ai)
+            self.ai_nicknames = self.random.sample([n for n in dummy_names if n not in self.nicknames], n_ai)
+            if deal:
+                self.ai_nicknames = list(deal['ai_nicknames'])
             self.nicknames = self.nicknames + self.ai_nicknames
         self.platform = platform
         self.n_players = len(self.nicknames)
@@ -71,23 +152,61 @@ class Avalon:
         self.has_lake_lady = has_lake_lady
         if self.has_lake_lady:
             if self.platform == 'socket':
-                self.stages.insert(1, 'lake_lady')
+                self.stages.insert(1, Stage.LAKE_LADY)
             else:
-                self.stages.insert(0, 'lake_lady')
+                self.stages.insert(0, Stage.LAKE_LADY)
         self.n_good, self.n_evil = self.get_n_sides()
         self.validate_setting()
         self.quests = self.get_quests()
         self.need_2_fail_cards = self.get_need_2_fail_cards()
         self.characters, self.good_characters, self.evil_characters = self.get_characters()
         self.p_positions = self.get_p_positions()
+        self.seats = SeatRing(self.p_positions, self.human_nicknames)
         self.players_info = self.get_players_info()
         self.game_param = self.init_game_param()
-        self.game_param_copy = copy.deepcopy(self.game_param)
-        self.game_records = {1: []}
-        # self.msg_packs = self.gen_msg_packs()
-        self.client_calls_count = 0
-
-        open('log/log', 'w').close()
+        # running counts of votes, attempts and quest results, see lib.state.Tally
+        self.tally = Tally()
+        # the game records, one row per round in NumPy columns, see lib.history
+        self.history = GameHistory(self.p_positions)
+        self.records_renderer = RecordsRenderer(self)
+        # rendered game info, players info and game records, see self.show_game_info() etc.
+        self.render_cache = RenderCache()
+        # cached call plans and format fields for the message packs, see self.get_call_plan()
+        self.call_plans = {}
+        self.format_fields = {}
+        # message packs are only used by the 'socket' platform
+        if self.platform == 'socket':
+            self.msg_packs = self.gen_msg_packs()
+        # 'revision' goes up by one on every change of the game, see self.notify_change()
+        # 'handled_revision' is the last revision the engine (self.api_server_run() or self.server_run()) has handled
+        self.change_condition = threading.Condition()
+        self.revision = 0
+        self.handled_revision = 0
+        self.engine_thread = None
+        self.subscribers = []
+        self.n_actions = 0  # n of actions made by players and computer players
+
+        # Every game has its own event log 'log_dir/game_id.jsonl', pass log_dir=None to turn it off
+        self.game_id = game_id if game_id else time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+        self.event_log = EventLog(os.path.join(log_dir, f'{self.game_id}.jsonl')) if log_dir else None
+        self.log_event('setup',
+                       nicknames=self.human_nicknames,
+                       ai_nicknames=self.ai_nicknames,
+                       has_percival=self.has_percival,
+                       has_morgana=self.has_morgana,
+                       has_mordred=self.has_mordred,
+                       has_oberon=self.has_oberon,
+                       has_lake_lady=self.has_lake_lady,
+                       platform=self.platform,
+                       seed=self.seed,
+                       p_positions=self.p_positions,
+                       characters=self.characters)
+        self.log_state()
+
+        # Latency of the engine steps, only collected if instrument is True or a LatencyMetrics to share between games
+        self.metrics = None
+        if instrument:
+            self.instrument(instrument if isinstance(instrument, LatencyMetrics) else LatencyMetrics())
 
     def validate_setting(self):
         if self.n_players not in range(5, 11):
@@ -167,6 +286,13 @@ class Avalon:
         else:
             return False
 
+    def get_n_fail_needed(self, quest):
+        """
+        To get the n of fail cards that fail the quest (1 to 5), the 4th quest of a game with 7 or more players only
+        fails with 2 fail cards.
+        """
+        return 2 if self.need_2_fail_cards and quest == 4 else 1
+
     def get_characters(self):
         """
         To get a list of characters that would be played in the game based on the game setting.
@@ -215,7 +341,9 @@ class Avalon:
         Last player of this list will be the first lady of the lake, if applicable.
         """
         p_position = self.nicknames.copy()
-        random.shuffle(p_position)
+        self.random.shuffle(p_position)
+        if self.deal:
+            return list(self.deal['p_positions'])
 
         return p_position
 
@@ -273,7 +401,9 @@ class Avalon:
         """
 
         # Shuffle the characters list, combine with the positional nicknames list to form the dict
-        random.shuffle(self.characters)
+        self.random.shuffle(self.characters)
+        if self.deal:
+            self.characters = list(self.deal['characters'])
         players_info = {
             nickname: {
                 'character': character,
@@ -285,107 +415,66 @@ class Avalon:
                                                      self.characters)
         }
 
-        # Iterate the nicknames to define target's character and side
+        # Build the knowledge of all players at once as a matrix indexed by position (see lib.knowledge), each player's
+        # knowledge is a row of it, which still works like a dict of {nickname: 'good'/'evil'/'unknown'/'either'}
         # Example: if the target's character is Merlin, means all players' side will be revealed in his knowledge,
         # providing Mordred is not included in the game
-        for nickname in self.nicknames:
-            target_character = players_info[nickname]['character']
-            target_side = players_info[nickname]['side']
-            knowledge = {}
-
-            for key, info in players_info.items():
-                if target_side == 'good':
-                    if target_character == 'merlin':
-                        # if *mordred* involves, all good players + *mordred* are unknown to *merlin*
-                        # Otherwise *merlin* knows everyone's side.
-                        if self.has_mordred:
-                            if info['character'] == 'mordred' or info['side'] == 'good':
-                                knowledge[key] = 'unknown'
-                            else:
-                                knowledge[key] = info['side']
-                        else:
-                            knowledge[key] = info['side']
-
-                    # *percival* only has knowledge on either *merlin*/*morgana*
-                    # The rest of player's side remain unknown to him.
-                    elif target_character == 'percival':
-                        if info['character'] in ['merlin', 'morgana']:
-                            if self.has_morgana:
-                                knowledge[key] = 'either'
-                            else:
-                                knowledge[key] = info['side']
-                        else:
-                            knowledge[key] = 'unknown'
-                    # all normal good players have no knowledge
-                    else:
-                        knowledge[key] = 'unknown'
-
-                else:
-                    if self.has_oberon:
-                        # If *oberon* involves, the player who plays as oberon doesn't have any knowledge
-                        # so everyone is unknown to him
-                        if target_character == 'oberon':
-                            knowledge[key] = 'unknown'
-                        # For the rest of evil players, (n_good_players + 1) now are unknown to them as
-                        # *oberon* is among them.
-                        else:
-                            if info['character'] == 'oberon' or info['side'] == 'good':
-                                knowledge[key] = 'unknown'
-                            # They still know other evil players who are not *oberon*
-                            else:
-                                knowledge[key] = info['side']
-                    # If no *oberon*, evil players know everyone's side
-                    else:
-                        knowledge[key] = info['side']
-                players_info[nickname]['knowledge'] = knowledge
+        self.knowledge = Knowledge(self.p_positions,
+                                   self.characters,
+                                   self.good_characters,
+                                   has_morgana=self.has_morgana,
+                                   has_mordred=self.has_mordred,
+                                   has_oberon=self.has_oberon)
+        for nickname in self.p_positions:
+            players_info[nickname]['knowledge'] = self.knowledge.row(nickname)
 
         return players_info
 
     def init_game_param(self):
         """
         To initiate the value of all game parameters.
-        game_param stores all the information of the game, it is for all players, and also the server to determine
-        the progress of the game.
+        game_param (see lib.state.GameState) stores all the information of the game, it is for all players, and also
+        the server to determine the progress of the game.
         It is also used to determine which game message should be displayed to players.
         """
 
-        game_param = {
-            'quest': 1,  # current quest
-            'round': 1,  # current round
-            'stage': self.stages[1] if self.has_lake_lady else self.stages[0],  # current stage
-            'n_members': self.quests[0],  # n of members that is required for completing the quest
-            'leader': self.p_positions[0],  # initial leader, first player from the position list,
-            'members': [],  # players that are selected by leader for quest
-            'done_proposal': None,  # indicator for proposal stage is completed
-            'votes': {},  # for storing votes details, format is {'player1': 'approve', 'player2': 'rejected', ...}
-            'p_no_vote': [],  # for storing the nicknames who haven't voted
-            'done_vote': None,  # indicator the vote stage is completed
-            'n_approve': None,  # n of approve vote
-            'vote_result': None,  # either 'approved' or 'rejected'
-            'attempts': {},  # for storing attempts details, format is {'player1': 'fail', 'player2': 'success', ...}
-            'p_no_attempt': [],  # for storing the nicknames who haven't attempted to fail or success the quest
-            'done_quest': None,  # indicator for quest stage is completed
-            'n_fail': None,  # n of fail cards in quest
-            'quest_result': None,  # either 'fail' or 'success'
-            'quest_results': [],  # to store the previous quest results
-            'win_3_quests': None,  # indicator if either good/evil side has won at least 3 quests
-            'assassin_target': None,  # the player that assassin picks if good side wins 3 quests
-            'assassin_success': None  # indicator if assassin correctly picks Merlin
-        }
+        game_param = GameState(
+            quest=1,  # current quest
+            round=1,  # current round
+            stage=self.stages[1] if self.has_lake_lady else self.stages[0],  # current stage
+            n_members=self.quests[0],  # n of members that is required for completing the quest
+            leader=self.p_positions[0],  # initial leader, first player from the position list,
+            members=[],  # players that are selected by leader for quest
+            done_proposal=None,  # indicator for proposal stage is completed
+            votes={},  # for storing votes details, format is {'player1': 'approve', 'player2': 'rejected', ...}
+            p_no_vote=Pool(),  # for storing the nicknames who haven't voted
+            done_vote=None,  # indicator the vote stage is completed
+            n_approve=None,  # n of approve vote
+            vote_result=None,  # either 'approved' or 'rejected'
+            attempts={},  # for storing attempts details, format is {'player1': 'fail', 'player2': 'success', ...}
+            p_no_attempt=Pool(),  # for storing the nicknames who haven't attempted to fail or success the quest
+            done_quest=None,  # indicator for quest stage is completed
+            n_fail=None,  # n of fail cards in quest
+            quest_result=None,  # either 'fail' or 'success'
+            quest_results=[],  # to store the previous quest results
+            win_3_quests=None,  # indicator if either good/evil side has won at least 3 quests
+            assassin_target=None,  # the player that assassin picks if good side wins 3 quests
+            assassin_success=None  # indicator if assassin correctly picks Merlin
+        )
 
         if self.has_lake_lady:
-            game_param['lake_lady'] = self.p_positions[-1]  # first lady of the lake, last player in position list
-            game_param['lake_lady_target'] = None  # the player that lady of the lake picks
+            game_param.lake_lady = self.p_positions[-1]  # first lady of the lake, last player in position list
+            game_param.lake_lady_target = None  # the player that lady of the lake picks
             # the nicknames for those never be lady of the lake
             # lady of the lake could not pick any player who was the previous lady of the lake
-            p_no_lake_lady = self.nicknames.copy()
-            p_no_lake_lady.remove(game_param['lake_lady'])
-            game_param['p_no_lake_lady'] = p_no_lake_lady
-            game_param['done_lake_lady'] = None  # indicator if lake lady stage is completed
-
-        # To store nicknames in good/evil list based on their characters
-        p_good = []
-        p_evil = []
+            p_no_lake_lady = Pool(self.nicknames)
+            p_no_lake_lady.remove(game_param.lake_lady)
+            game_param.p_no_lake_lady = p_no_lake_lady
+            game_param.done_lake_lady = None  # indicator if lake lady stage is completed
+
+        # To store nicknames in good/evil pool based on their characters
+        p_good = Pool()
+        p_evil = Pool()
         sides = {}
         for nickname, info in self.players_info.items():
             sides[nickname] = info['side']
@@ -396,32 +485,39 @@ class Avalon:
             if info['character'] not in ['loyal_servant', 'minion']:
                 game_param[info['character']] = nickname
 
-        game_param['sides'] = sides
-        game_param['p_good'] = p_good
-        game_param['p_evil'] = p_evil
+        game_param.sides = sides
+        game_param.p_good = p_good
+        game_param.p_evil = p_evil
 
         # To store the progress of each player
         # This parameter is to tell the server which game message should be picked and what event should be triggered
-        game_param['progress'] = {
+        game_param.progress = {
             nickname: {
                 'stage': self.stages[0],
                 'step': 0
             } for nickname in self.nicknames if nickname in self.human_nicknames
         }
-        game_param['client_calls'] = {
+        game_param.client_calls = {
             nickname: list() for nickname in self.human_nicknames
         }
 
-        game_param['speaker'] = N if any((N := n) for n in self.p_positions if n in self.human_nicknames) else ''
-        game_param['p_no_speak'] = [n for n in self.p_positions if n in self.human_nicknames][1:]
-        game_param['done_speak'] = None
+        # the human players speak in turn from the leader, 'p_no_speak' is the queue of the players after 'speaker'
+        game_param.p_no_speak = self.seats.get_speakers(game_param.leader)
+        game_param.speaker = game_param.p_no_speak.popleft() if game_param.p_no_speak else ''
+        game_param.done_speak = None
 
         return game_param
 
     def show_game_info(self):
         """
         To show the summary of the game. Could be requested by player.
+        The render is cached until the quest, round, leader or lady of the lake changes.
         """
+        stamp = (self.game_param.quest, self.game_param.round, self.game_param.leader,
+                 self.game_param.lake_lady if self.has_lake_lady else None)
+        return self.render_cache.get(('game_info',), stamp, self.render_game_info)
+
+    def render_game_info(self):
         info = ''
         info += 'Number of player: Good {}, Evil {}\n'.format(self.n_good, self.n_evil)
         quests_in_str = ', '.join(str(self.quests[i]) + '*' if self.need_2_fail_cards and i == 3
@@ -434,11 +530,11 @@ class Avalon:
         if 'minion' in self.evil_characters:
             evil_characters_in_str += ', minion x{}'.format(self.evil_characters.count('minion'))
         info += 'Evil Characters: {}\n'.format(evil_characters_in_str)
-        info += 'Current Quest: {}\n'.format(self.game_param['quest'])
-        info += 'Current vote Round: {}\n'.format(self.game_param['round'])
-        info += 'Current Leader: {}\n'.format(self.game_param['leader'])
+        info += 'Current Quest: {}\n'.format(self.game_param.quest)
+        info += 'Current vote Round: {}\n'.format(self.game_param.round)
+        info += 'Current Leader: {}\n'.format(self.game_param.leader)
         if self.has_lake_lady:
-            info += 'Current Lady of Lake: {}\n'.format(self.game_param['lake_lady'])
+            info += 'Current Lady of Lake: {}\n'.format(self.game_param.lake_lady)
 
         length = 0
         for line in info.splitlines():
@@ -452,7 +548,12 @@ class Avalon:
     def show_players_info(self, nickname=None):
         """
         To show player info in pretty table. Could be requested by player.
+        The render of each viewer is cached until the knowledge of the players changes, e.g. by lady of the lake.
         """
+        return self.render_cache.get(('players_info', nickname), self.knowledge.version,
+                                     lambda: self.render_players_info(nickname))
+
+    def render_players_info(self, nickname=None):
         t = PrettyTable()
         field_names = [i for i in list(self.players_info.values())[0] if i != 'knowledge']
         field_names.insert(0, 'nickname')
@@ -468,7 +569,7 @@ class Avalon:
                     for k, v in info.items():
                         if k == 'character':
                             if self.has_percival and \
-                                    nickname == self.game_param['percival'] \
+                                    nickname == self.game_param.percival \
                                     and v in ['merlin', 'morgana']:
                                 if self.has_morgana:
                                     row.append('merlin/morgana')
@@ -497,60 +598,24 @@ class Avalon:
                 t.add_row(row)
         return str(t)
 
-    def show_game_records(self, nickname, revealed=False):
+    def show_game_records(self, nickname, revealed=False, output='text'):
         """
         To show previous game records. Could be requested by player.
         If revealed is True, means all the players' details (side, if they have attempted to fail the quest) would
         be revealed.
+        output is 'text' for a pretty table or 'html' for an HTML table, e.g. for the Panel UI.
+        Rows are rendered once per viewer as the records are added (see lib.render.RecordsRenderer), and the whole
+        table is cached until a new record is added.
         """
-        t = PrettyTable()
-        field_names = ['Q', 'R', 'L', 'M']
-        if self.has_lake_lady:
-            field_names += ['LL', 'T']
+        return self.render_cache.get(('game_records', nickname, revealed, output), len(self.history),
+                                     lambda: self.records_renderer.render(nickname, revealed, output))
 
-        nicknames = [display_user_label(nickname, n) for n in self.nicknames]
-        if revealed:
-            nickname_with_star = [n + '*' if n in self.game_param['p_evil'] else n for n in self.nicknames]
-            field_names += sorted(nickname_with_star)
-        else:
-            field_names += sorted(nicknames)
-
-        field_names += ['N_A', 'VR', 'N_F', 'QR']
-        t.field_names = field_names
-
-        for quest, records in self.game_records.items():
-            for record in records:
-                row = [quest, record['round'], display_user_label(nickname, record['leader'])]
-                if record['round'] > 1:
-                    row = ['', record['round'], record['leader']]
-                if revealed:
-                    members_with_star = [display_user_label(nickname, n) + '*'
-                                         if n in self.game_param['p_evil'] else display_user_label(nickname, n)
-                                         for n in record['members']]
-                    row.append(', '.join(members_with_star))
-                else:
-
-                    row.append(', '.join([display_user_label(nickname, n) for n in record['members']]))
-
-                if self.has_lake_lady:
-                    row += [record['lake_lady'], record['lake_lady_target']]
-                if record['votes'] == {}:
-                    row_vote = ['-'] * self.n_players
-                else:
-                    row_vote = ['o' if record['votes'][n] == 'approve' else 'x' for n in sorted(record['votes'].keys())]
-                row += row_vote + [record['n_approve'], record['vote_result']]
-                if record['quest_result'] is not None:
-                    if revealed:
-                        members = [k for k, v in record['attempts'].items() if v == 'fail']
-                        row += [', '.join(members), record['quest_result']]
-                    else:
-                        row += [record['n_fail'], record['quest_result']]
-                else:
-                    row += ['N/A', 'N/A']
-
-                t.add_row(row)
-
-        return str(t)
+    def get_game_record_rows(self, nickname, revealed=False, start=0):
+        """
+        To get the game records from the start-th round as a list of {column: value}, so a table widget (e.g. Panel's
+        Tabulator) could stream the new rows instead of reloading the whole records.
+        """
+        return self.records_renderer.get_rows(nickname, revealed, start)
 
     def show_votes(self, nickname):
         """
@@ -558,7 +623,7 @@ class Avalon:
         """
         t = PrettyTable()
         t.field_names = ['Player', 'Vote']
-        for k, v in self.game_param['votes'].items():
+        for k, v in self.game_param.votes.items():
             if k == nickname:
                 k += '(You)'
             t.add_row([k, v])
@@ -577,7 +642,7 @@ class Avalon:
         if key == 'nickname':
             return nickname
         # To convert list to string, mainly target for parameters like 'members', 'p_no_vote' etc
-        elif isinstance(self.game_param[key], list):
+        elif isinstance(self.game_param[key], (list, Pool)):
             return ', '.join(self.game_param[key])
         # To look further in game_param with nickname, mainly target for parameters like 'votes' and 'attempts'
         elif isinstance(self.game_param[key], dict):
@@ -603,9 +668,11 @@ class Avalon:
 
     def gen_msg_packs(self):
         """
-        To pre-generated the game message 'packs' and allow players to pick the specific pack based on their progress.
+        To set up the game message 'packs' and allow players to pick the specific pack based on their progress.
         The message pack are store in dict format.
-        There are total 5 + 1 stages and each stage contains a list of different message packs.
+        There are total 5 + 1 stages and each stage contains a list of different message packs, generated by the
+        gen_<stage>_msg_packs() function of the stage the first time any player enters the stage (see MsgPacks), so a
+        game doesn't build the packs of stages it never reaches.
         Then all lists would be again, stored as dict format, where the stage as the key. The example is shown below:
 
         {
@@ -625,16 +692,17 @@ class Avalon:
             ...
         }
 
-        The 'stage', 'step' items in self.game_param['progress'][nickname] will determine which message would be picked
+        The 'stage', 'step' items in self.game_param.progress[nickname] will determine which message would be picked
         for specific player, where 'stage' tell the system which list to look into, and 'step' is the index of the
         message pack in list.
 
-        There are 4 items (or less) in game message pack, which are:
+        There are 5 items (or less) in game message pack, which are:
 
         'msg': The content of the message or the function to generate the message.
 
         'condition': The condition (in string format) if this message should be displayed under different circumstance.
-        This string then would be evaluated by using eval() to determine if the condition is met.
+        All conditions are compiled to code objects once the packs of a stage are generated, then evaluated by using
+        eval() to determine if the condition is met, so the string is not parsed again every time a player moves on.
         Note that there is a little hack here by using f"{parameter=}".split('=')[0] to get the name of the parameter.
         This method would report error if you change the parameter name somewhere else, which makes the debugging
         easier.
@@ -644,344 +712,421 @@ class Avalon:
 
         'wait': Indicator to tell player the game could only proceed if some other event is completed. With this, the
         messages would be picked up repeatedly and displayed until some other player completes his event.
+
+        'options': The name of the options list (see self.get_options()) to show below the message. Options are listed
+        when the message is displayed, so lists that change during the game (e.g. 'p_no_lake_lady') are up to date.
         """
-        msg_packs = {stage: list() for stage in self.stages}
+        builders = dict((stage, getattr(self, f'gen_{stage}_msg_packs')) for stage in self.stages)
+        return MsgPacks(builders)
+
+    def prepare_msg_packs(self, msg_packs):
+        """
+        To compile all conditions of the message packs once, instead of parsing the strings in every
+        self.get_msg_pack() call. Also build the call plans and format fields that self.process_msg() and
+        self.process_event() would need.
+        """
+        for msg_pack in msg_packs:
+            if 'condition' in msg_pack.keys():
+                msg_pack['condition'] = compile(msg_pack['condition'], '<condition>', 'eval')
+            if 'msg' in msg_pack.keys():
+                if inspect.ismethod(msg_pack['msg']):
+                    self.get_call_plan(msg_pack['msg'])
+                else:
+                    self.get_format_fields(msg_pack['msg'])
+            if 'event' in msg_pack.keys():
+                self.get_call_plan(msg_pack['event'])
+        return msg_packs
 
-        msg_packs['init'] = list(map(lambda m: {'msg': m},
-                                     ['Hi {nickname}, welcome to Avalon.',
-                                      self.show_game_info,
-                                      self.show_players_info]))
+    def gen_init_msg_packs(self):
+        """
+        To generate the message packs of 'init' stage, see self.gen_msg_packs().
+        """
+        msg_packs = list(map(lambda m: {'msg': m},
+                             ['Hi {nickname}, welcome to Avalon.',
+                              self.show_game_info,
+                              self.show_players_info]))
 
         msg_pack = {
             'msg': 'Please wait other players to complete init stage.'
         }
-        msg_packs['init'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
-        if self.has_lake_lady:
-            msg_pack = {
-                'msg': 'You are the lady of the lake.',
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " == nickname"
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        return self.prepare_msg_packs(msg_packs)
 
-            msg_pack = {
-                'msg': '{lake_lady} is the lady of the lake.',
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " != nickname"
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+    def gen_lake_lady_msg_packs(self):
+        """
+        To generate the message packs of 'lake_lady' stage, see self.gen_msg_packs().
+        """
+        msg_packs = []
 
-            msg_pack = {
-                'msg': 'Please select your target or type x for not using your power this round. \n' +
-                       self.get_options('p_no_lake_lady', self.game_param),
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " == nickname"
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        msg_pack = {
+            'msg': 'You are the lady of the lake.',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " == nickname"
+        }
+        msg_packs.append(msg_pack)
 
-            msg_pack = {
-                'msg': 'Please wait if the lady of the lake {lake_lady} wants to use her power.',
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " != nickname",
-                'wait': 'done_lake_lady'
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        msg_pack = {
+            'msg': '{lake_lady} is the lady of the lake.',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " != nickname"
+        }
+        msg_packs.append(msg_pack)
 
-            msg_pack = {
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " == nickname",
-                'event': self.use_lake_lady_power
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        msg_pack = {
+            'msg': 'Please select your target or type x for not using your power this round. \n',
+            'options': 'p_no_lake_lady',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " == nickname"
+        }
+        msg_packs.append(msg_pack)
 
-            msg_pack = {
-                'msg': 'You have selected {lake_lady_target} and he is on {sides} side.',
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " == nickname and " +
-                             f"{self.game_param['done_lake_lady']=}".split('=')[0] + " and " +
-                             f"{self.game_param['lake_lady_target']=}".split('=')[0]
+        msg_pack = {
+            'msg': 'Please wait if the lady of the lake {lake_lady} wants to use her power.',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " != nickname",
+            'wait': 'done_lake_lady'
+        }
+        msg_packs.append(msg_pack)
 
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        msg_pack = {
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " == nickname",
+            'event': self.use_lake_lady_power
+        }
+        msg_packs.append(msg_pack)
 
-            msg_pack = {
-                'msg': 'You have decided not to use your power this round.',
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " == nickname and " +
-                             f"{self.game_param['done_lake_lady']=}".split('=')[0] + " and " +
-                             f"not {self.game_param['lake_lady_target']=}".split('=')[0]
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        msg_pack = {
+            'msg': 'You have selected {lake_lady_target} and he is on {sides} side.',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " == nickname and " +
+                         f"{self.game_param.done_lake_lady=}".split('=')[0] + " and " +
+                         f"{self.game_param.lake_lady_target=}".split('=')[0]
 
-            msg_pack = {
-                'msg': 'The lady of the lake {lake_lady} has selected {lake_lady_target} and know his side.',
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " != nickname and " +
-                             f"{self.game_param['done_lake_lady']=}".split('=')[0] + " and " +
-                             f"{self.game_param['lake_lady_target']=}".split('=')[0]
+        }
+        msg_packs.append(msg_pack)
 
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        msg_pack = {
+            'msg': 'You have decided not to use your power this round.',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " == nickname and " +
+                         f"{self.game_param.done_lake_lady=}".split('=')[0] + " and " +
+                         f"not {self.game_param.lake_lady_target=}".split('=')[0]
+        }
+        msg_packs.append(msg_pack)
 
-            msg_pack = {
-                'msg': 'The lady of the lake {lake_lady} has decided not to use your power this round.',
-                'condition': f"{self.game_param['lake_lady']=}".split('=')[0] + " != nickname and " +
-                             f"{self.game_param['done_lake_lady']=}".split('=')[0] + " and " +
-                             f"not {self.game_param['lake_lady_target']=}".split('=')[0]
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        msg_pack = {
+            'msg': 'The lady of the lake {lake_lady} has selected {lake_lady_target} and know his side.',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " != nickname and " +
+                         f"{self.game_param.done_lake_lady=}".split('=')[0] + " and " +
+                         f"{self.game_param.lake_lady_target=}".split('=')[0]
 
-            msg_pack = {
-                'msg': 'Please wait other players to complete lake lady stage.'
-            }
-            msg_packs['lake_lady'].append(msg_pack)
+        }
+        msg_packs.append(msg_pack)
+
+        msg_pack = {
+            'msg': 'The lady of the lake {lake_lady} has decided not to use your power this round.',
+            'condition': f"{self.game_param.lake_lady=}".split('=')[0] + " != nickname and " +
+                         f"{self.game_param.done_lake_lady=}".split('=')[0] + " and " +
+                         f"not {self.game_param.lake_lady_target=}".split('=')[0]
+        }
+        msg_packs.append(msg_pack)
+
+        msg_pack = {
+            'msg': 'Please wait other players to complete lake lady stage.'
+        }
+        msg_packs.append(msg_pack)
+
+        return self.prepare_msg_packs(msg_packs)
+
+    def gen_proposal_msg_packs(self):
+        """
+        To generate the message packs of 'proposal' stage, see self.gen_msg_packs().
+        """
+        msg_packs = []
 
         msg_pack = {
             'msg': 'Quest {quest} Round {round}'
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Warning! This is voting round 5.\n'
                    'Whoever the current leader proposed to do the quest will be approved without vote!\n',
-            'condition': f"{self.game_param['round']=}".split('=')[0] + " == 5",
+            'condition': f"{self.game_param.round=}".split('=')[0] + " == 5",
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'You are the current leader\n',
-            'condition': f"{self.game_param['leader']=}".split('=')[0] + " == nickname"
+            'condition': f"{self.game_param.leader=}".split('=')[0] + " == nickname"
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': '{leader} is the current leader\n',
-            'condition': f"{self.game_param['leader']=}".split('=')[0] + " != nickname"
+            'condition': f"{self.game_param.leader=}".split('=')[0] + " != nickname"
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
-            'msg': 'Please select {n_members} members to do the quest {quest} (Example: 1 2 3)\n' +
-                   self.get_options('nicknames'),
-            'condition': f"{self.game_param['leader']=}".split('=')[0] + " == nickname"
+            'msg': 'Please select {n_members} members to do the quest {quest} (Example: 1 2 3)\n',
+            'options': 'nicknames',
+            'condition': f"{self.game_param.leader=}".split('=')[0] + " == nickname"
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait leader {leader} to select members to do quest {quest}.',
-            'condition': f"{self.game_param['leader']=}".split('=')[0] + " != nickname and " +
-                         f"not {self.game_param['members']=}".split('=')[0],
+            'condition': f"{self.game_param.leader=}".split('=')[0] + " != nickname and " +
+                         f"not {self.game_param.members=}".split('=')[0],
             'wait': 'done_proposal'
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'You have selected {members} to do quest {quest}.',
-            'condition': f"{self.game_param['leader']=}".split('=')[0] + " == nickname",
+            'condition': f"{self.game_param.leader=}".split('=')[0] + " == nickname",
             'event': self.propose_quest
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Leader {leader} has selected {members} to do quest {quest}.',
-            'condition': f"{self.game_param['leader']=}".split('=')[0] + " != nickname"
+            'condition': f"{self.game_param.leader=}".split('=')[0] + " != nickname"
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait other players to complete proposal stage.'
         }
-        msg_packs['proposal'].append(msg_pack)
+        msg_packs.append(msg_pack)
+
+        return self.prepare_msg_packs(msg_packs)
+
+    def gen_vote_msg_packs(self):
+        """
+        To generate the message packs of 'vote' stage, see self.gen_msg_packs().
+        """
+        msg_packs = []
 
         msg_pack = {
-            'msg': 'Please vote if you approve or reject {members} to do quest {quest}.\n' +
-                   self.get_options('vote_cards')
+            'msg': 'Please vote if you approve or reject {members} to do quest {quest}.\n',
+            'options': 'vote_cards'
         }
-        msg_packs['vote'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'You have voted {votes}',
             'event': self.vote_quest
         }
-        msg_packs['vote'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait for other player(s) {p_no_vote} to vote.',
-            'condition': f"not {self.game_param['done_vote']=}".split('=')[0],
+            'condition': f"not {self.game_param.done_vote=}".split('=')[0],
             'wait': 'done_vote'
         }
-        msg_packs['vote'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': self.show_votes
         }
-        msg_packs['vote'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Total {n_approve} approve, the proposal is {vote_result}.'
         }
-        msg_packs['vote'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait other players to complete vote stage.'
         }
-        msg_packs['vote'].append(msg_pack)
+        msg_packs.append(msg_pack)
+
+        return self.prepare_msg_packs(msg_packs)
+
+    def gen_quest_msg_packs(self):
+        """
+        To generate the message packs of 'quest' stage, see self.gen_msg_packs().
+        """
+        msg_packs = []
 
         msg_pack = {
             'msg': 'You are selected to do quest {quest}.',
-            'condition': "nickname in " + f"{self.game_param['members']=}".split('=')[0]
+            'condition': "nickname in " + f"{self.game_param.members=}".split('=')[0]
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
-            'msg': 'You are on evil side. Please select your attempt.\n' +
-                   self.get_options('quest_cards'),
-            'condition': "nickname in " + f"{self.game_param['members']=}".split('=')[0] + " and " +
-                         "nickname in " + f"{self.game_param['p_evil']=}".split('=')[0]
+            'msg': 'You are on evil side. Please select your attempt.\n',
+            'options': 'quest_cards',
+            'condition': "nickname in " + f"{self.game_param.members=}".split('=')[0] + " and " +
+                         "nickname in " + f"{self.game_param.p_evil=}".split('=')[0]
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'You are on good side. You could only attempt to success the quest.\n',
-            'condition': "nickname in " + f"{self.game_param['members']=}".split('=')[0] + " and " +
-                         "nickname in " + f"{self.game_param['p_good']=}".split('=')[0]
+            'condition': "nickname in " + f"{self.game_param.members=}".split('=')[0] + " and " +
+                         "nickname in " + f"{self.game_param.p_good=}".split('=')[0]
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'You attempt to {attempts} quest {quest}.',
-            'condition': "nickname in " + f"{self.game_param['members']=}".split('=')[0],
+            'condition': "nickname in " + f"{self.game_param.members=}".split('=')[0],
             'event': self.do_quest
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': '{members} are now doing quest {quest}',
-            'condition': "nickname not in " + f"{self.game_param['members']=}".split('=')[0]
+            'condition': "nickname not in " + f"{self.game_param.members=}".split('=')[0]
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait. {p_no_attempt} are now doing quest {quest}',
-            'condition': f"not {self.game_param['done_quest']=}".split('=')[0],
+            'condition': f"not {self.game_param.done_quest=}".split('=')[0],
             'wait': 'done_quest'
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Total {n_fail} fail, the quest result is {quest_result}.'
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait other players to complete quest stage.'
         }
-        msg_packs['quest'].append(msg_pack)
+        msg_packs.append(msg_pack)
+
+        return self.prepare_msg_packs(msg_packs)
+
+    def gen_record_msg_packs(self):
+        """
+        To generate the message packs of 'record' stage, see self.gen_msg_packs().
+        """
+        msg_packs = []
 
         msg_pack = {
             'msg': self.show_game_records
         }
-        msg_packs['record'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait other players to complete record stage.'
         }
-        msg_packs['record'].append(msg_pack)
+        msg_packs.append(msg_pack)
+
+        return self.prepare_msg_packs(msg_packs)
+
+    def gen_end_msg_packs(self):
+        """
+        To generate the message packs of 'end' stage, see self.gen_msg_packs().
+        """
+        msg_packs = []
 
         msg_pack = {
             'msg': 'The {win_3_quests} side have won 3 quests.',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0]
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0]
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Now evil side have their last chance for Assassin to identify who is Merlin!',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good'"
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good'"
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'You are the assassin.',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " == nickname"
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " == nickname"
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': '{assassin} is the assassin.',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " != nickname"
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " != nickname"
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
-            'msg': 'Please choose your target.\n' + self.get_options('p_good', self.game_param),
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " == nickname"
+            'msg': 'Please choose your target.\n',
+            'options': 'p_good',
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " == nickname"
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Please wait assassin {assassin} to choose his target.',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " != nickname",
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " != nickname",
             'wait': 'assassin_target'
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'You have picked {assassin_target}.',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " == nickname",
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " == nickname",
             'event': self.assassinate
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'Assassin {assassin} has picked {assassin_target}.',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " != nickname"
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " != nickname"
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'And you did it! {merlin} is Merlin! Evil side win!',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " == nickname and " +
-                         f"{self.game_param['assassin_success']=}".split('=')[0]
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " == nickname and " +
+                         f"{self.game_param.assassin_success=}".split('=')[0]
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'And you missed it! {merlin} is Merlin! Good side win!',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " == nickname and " +
-                         f"not {self.game_param['assassin_success']=}".split('=')[0]
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " == nickname and " +
+                         f"not {self.game_param.assassin_success=}".split('=')[0]
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'And Assassin {assassin} did it! {merlin} is Merlin! Evil side win!',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " != nickname and " +
-                         f"{self.game_param['assassin_success']=}".split('=')[0]
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " != nickname and " +
+                         f"{self.game_param.assassin_success=}".split('=')[0]
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'And Assassin {assassin} missed it! {merlin} is Merlin! Good side win!',
-            'condition': f"{self.game_param['win_3_quests']=}".split('=')[0] + " == 'good' and " +
-                         f"{self.game_param['assassin']=}".split('=')[0] + " != nickname and " +
-                         f"not {self.game_param['assassin_success']=}".split('=')[0]
+            'condition': f"{self.game_param.win_3_quests=}".split('=')[0] + " == 'good' and " +
+                         f"{self.game_param.assassin=}".split('=')[0] + " != nickname and " +
+                         f"not {self.game_param.assassin_success=}".split('=')[0]
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
         msg_pack = {
             'msg': 'End Game. Thanks for playing'
         }
-        msg_packs['end'].append(msg_pack)
+        msg_packs.append(msg_pack)
 
-        return msg_packs
+        return self.prepare_msg_packs(msg_packs)
 
     def end_speak(self, nickname):
-        client_calls = self.game_param['client_calls'].get('nickname', [])
+        client_calls = self.game_param.client_calls.get('nickname', [])
         if not client_calls or (client_calls and client_calls[-1] != inspect.currentframe().f_code.co_name):
             print(f'{nickname}, {inspect.currentframe().f_code.co_name}')
-            self.game_param['client_calls'][nickname].append(inspect.currentframe().f_code.co_name)
-            self.game_param['speaker'] = None
+            self.game_param.client_calls[nickname].append(inspect.currentframe().f_code.co_name)
+            self.game_param.mark_changed('client_calls')
+            self.game_param.speaker = None
+            self.log_event('action', action='end_speak', nickname=nickname)
+            self.notify_change()
         return f'{nickname} ends speaking.'
 
     # This part is the functions for player's action.
@@ -989,12 +1134,15 @@ class Avalon:
         """
         For leader to propose the members to do quest.
         """
-        client_calls = self.game_param['client_calls'].get('nickname', [])
+        client_calls = self.game_param.client_calls.get('nickname', [])
         if not client_calls or (client_calls and client_calls[-1] != inspect.currentframe().f_code.co_name):
             print(f'{nickname}, {inspect.currentframe().f_code.co_name}')
             if nickname in self.human_nicknames:
-                self.game_param['client_calls'][nickname].append(inspect.currentframe().f_code.co_name)
-            self.game_param['members'] = members.copy()
+                self.game_param.client_calls[nickname].append(inspect.currentframe().f_code.co_name)
+                self.game_param.mark_changed('client_calls')
+            self.game_param.members = members.copy()
+            self.log_event('action', action='propose_quest', nickname=nickname, members=list(members))
+            self.notify_change()
             return f"Leader {nickname} selected {', '.join(members)}."
 
     def vote_quest(self, nickname, vote):
@@ -1002,13 +1150,17 @@ class Avalon:
         For player to vote the proposal from leader.
         If player has voted, he/she will be removed from 'p_no_vote' list.
         """
-        client_calls = self.game_param['client_calls'].get('nickname', [])
+        client_calls = self.game_param.client_calls.get('nickname', [])
         if not client_calls or (client_calls and client_calls[-1] != inspect.currentframe().f_code.co_name):
             print(f'{nickname}, {inspect.currentframe().f_code.co_name}')
             if nickname in self.human_nicknames:
-                self.game_param['client_calls'][nickname].append(inspect.currentframe().f_code.co_name)
-            self.game_param['votes'][nickname] = vote
-            self.game_param['p_no_vote'].remove(nickname)
+                self.game_param.client_calls[nickname].append(inspect.currentframe().f_code.co_name)
+            self.tally.add_vote(vote, self.game_param.votes.get(nickname))
+            self.game_param.votes[nickname] = vote
+            self.game_param.p_no_vote.remove(nickname)
+            self.game_param.mark_changed('client_calls', 'votes', 'p_no_vote')
+            self.log_event('action', action='vote_quest', nickname=nickname, vote=vote)
+            self.notify_change()
             return f'{nickname} voted {vote}.'
 
     def do_quest(self, nickname, attempt):
@@ -1016,25 +1168,32 @@ class Avalon:
         For player to attempt to fail/success the quest.
         If player has attempted, he/she will be removed from 'p_no_attempt' list.
         """
-        client_calls = self.game_param['client_calls'].get('nickname', [])
+        client_calls = self.game_param.client_calls.get('nickname', [])
         if not client_calls or (client_calls and client_calls[-1] != inspect.currentframe().f_code.co_name):
             print(f'{nickname}, {inspect.currentframe().f_code.co_name}')
             if nickname in self.human_nicknames:
-                self.game_param['client_calls'][nickname].append(inspect.currentframe().f_code.co_name)
-            self.game_param['attempts'][nickname] = attempt
-            self.game_param['p_no_attempt'].remove(nickname)
+                self.game_param.client_calls[nickname].append(inspect.currentframe().f_code.co_name)
+            self.tally.add_attempt(attempt, self.game_param.attempts.get(nickname))
+            self.game_param.attempts[nickname] = attempt
+            self.game_param.p_no_attempt.remove(nickname)
+            self.game_param.mark_changed('client_calls', 'attempts', 'p_no_attempt')
+            self.log_event('action', action='do_quest', nickname=nickname, attempt=attempt)
+            self.notify_change()
             return f'{nickname} attempted {attempt}.'
 
     def assassinate(self, nickname, target):
         """
         For assassin to pick his target.
         """
-        client_calls = self.game_param['client_calls'].get('nickname', [])
+        client_calls = self.game_param.client_calls.get('nickname', [])
         if not client_calls or (client_calls and client_calls[-1] != inspect.currentframe().f_code.co_name):
             print(f'{nickname}, {inspect.currentframe().f_code.co_name}')
             if nickname in self.human_nicknames:
-                self.game_param['client_calls'][nickname].append(inspect.currentframe().f_code.co_name)
-            self.game_param['assassin_target'] = target
+                self.game_param.client_calls[nickname].append(inspect.currentframe().f_code.co_name)
+                self.game_param.mark_changed('client_calls')
+            self.game_param.assassin_target = target
+            self.log_event('action', action='assassinate', nickname=nickname, target=target)
+            self.notify_change()
             return f'Assassin {nickname} selected {target}.'
 
     def use_lake_lady_power(self, nickname, target):
@@ -1043,49 +1202,272 @@ class Avalon:
         The player that she picked would be next lady of the lake so the name will be removed from 'p_no_lake_lady'.
         If the nickname is herself, means she decided not to use her power.
         """
-        client_calls = self.game_param['client_calls'].get('nickname', [])
+        client_calls = self.game_param.client_calls.get('nickname', [])
         if not client_calls or (client_calls and client_calls[-1] != inspect.currentframe().f_code.co_name):
             print(f'{nickname}, {inspect.currentframe().f_code.co_name}')
             if nickname in self.human_nicknames:
-                self.game_param['client_calls'][nickname].append(inspect.currentframe().f_code.co_name)
+                self.game_param.client_calls[nickname].append(inspect.currentframe().f_code.co_name)
+            self.game_param.mark_changed('client_calls')
+            if target:
+                self.game_param.lake_lady_target = target
+                self.game_param.p_no_lake_lady.remove(target)
+                self.game_param.mark_changed('p_no_lake_lady')
+            elif self.platform == 'socket':
+                # she typed 'x' to not use her power this round, there is nothing to reveal so the stage is done
+                self.game_param.done_lake_lady = True
+            self.log_event('action', action='use_lake_lady_power', nickname=nickname, target=target)
+            self.notify_change()
             if target:
-                self.game_param['lake_lady_target'] = target
-                self.game_param['p_no_lake_lady'].remove(target)
                 return f'The lady of lake {nickname} selected {target}.'
             return f'The lady of lake {nickname} decided not to user her power.'
 
     def trigger_ai_move(self, nickname):
         print(f'{nickname}, {inspect.currentframe().f_code.co_name}')
-        self.game_param['client_calls'][nickname].append(inspect.currentframe().f_code.co_name)
+        self.game_param.client_calls[nickname].append(inspect.currentframe().f_code.co_name)
+        self.game_param.mark_changed('client_calls')
+        self.log_event('action', action='trigger_ai_move', nickname=nickname)
+        self.notify_change()
         return f'Admin {nickname} triggered AI move.'
 
     # This part is the function for system
+    def notify_change(self):
+        """
+        To bump self.revision after any change of the game and wake up whoever is waiting for it.
+        Every action method calls this once its change is applied, the engine calls it once after each pass.
+
+        Changes made by the engine itself (including the computer players' actions) are marked as handled straight
+        away, so the engine only wakes up again for changes coming from the players. handled_revision only moves past
+        a change of the engine if everything before it is handled, so a change another thread makes during the pass
+        (e.g. a client on 'socket' platform) is still there for the next pass.
+        """
+        with self.change_condition:
+            self.revision += 1
+            if self.engine_thread == threading.get_ident() and self.handled_revision == self.revision - 1:
+                self.handled_revision = self.revision
+            revision = self.revision
+            subscribers = self.subscribers.copy()
+            self.change_condition.notify_all()
+        for callback in subscribers:
+            callback(revision)
+
+    def subscribe(self, callback):
+        """
+        To register a callback that is called with the new revision after every change of the game.
+        The callback runs in the thread that made the change, so it should be quick (e.g. set a flag or schedule a
+        refresh). Return a function to unsubscribe.
+        """
+        with self.change_condition:
+            self.subscribers.append(callback)
+
+        def unsubscribe():
+            with self.change_condition:
+                if callback in self.subscribers:
+                    self.subscribers.remove(callback)
+
+        return unsubscribe
+
+    def wait_for_revision(self, revision, timeout=None):
+        """
+        To block until the game moves past the given revision, or until timeout (in seconds) is reached.
+        Return the current revision, so observers could keep calling it with the value returned last time.
+        """
+        with self.change_condition:
+            self.change_condition.wait_for(lambda: self.revision > revision, timeout)
+            return self.revision
+
+    def wait_for_change(self, timeout=None):
+        """
+        To block until there is a change that the engine has not handled yet.
+        Return True if there is something to handle, or False if timeout (in seconds) is reached first.
+
+        This allows the engine thread to sleep while nobody is playing instead of spinning on self.api_server_run().
+        """
+        with self.change_condition:
+            return self.change_condition.wait_for(lambda: self.revision != self.handled_revision, timeout)
+
+    def start_engine_pass(self):
+        """
+        To mark all changes so far as handled before the engine processes them, the pass starts from this revision.
+        Return False if nothing has changed since the last pass.
+        """
+        with self.change_condition:
+            if self.revision == self.handled_revision:
+                return False
+            self.handled_revision = self.revision
+            self.engine_thread = threading.get_ident()
+            return True
+
+    def end_engine_pass(self):
+        """
+        To publish the changes made during the engine pass as a single new revision.
+        """
+        self.notify_change()
+        self.engine_thread = None
+        self.log_event('engine',
+                       stage=self.game_param.stage,
+                       quest=self.game_param.quest,
+                       round=self.game_param.round)
+        self.log_state()
+
+    def log_event(self, event, **data):
+        """
+        To put a small record in the event log of this game (see lib.event_log), e.g. an action or an engine pass.
+        Nothing is logged if the game is created without log_dir, but actions are always counted in self.n_actions.
+        """
+        if event == 'action':
+            self.n_actions += 1
+        if self.event_log is not None:
+            record = {'event': event, 'revision': self.revision}
+            record.update(data)
+            self.event_log.write(record)
+
+    def log_state(self):
+        """
+        To log the changes of game_param since the last logged revision, with a full snapshot every now and then
+        (see lib.event_log.StateLogger). Only the parameters that game_param noted as changed are copied here, they
+        are serialized and compared with the logged ones by the writer thread of the event log.
+        """
+        if self.event_log is not None:
+            changed = self.game_param.pop_changed()
+            if changed:
+                self.event_log.write_state(self.revision, self.game_param, changed)
+
+    def instrument(self, metrics):
+        """
+        To time every engine step in self.timed_steps and record it in the latency histograms of metrics.
+        The methods are only wrapped on this instance, so a game that is not instrumented runs the plain methods and
+        pays nothing for it.
+        """
+        self.metrics = metrics
+        for name in self.timed_steps:
+            setattr(self, name, metrics.timed(name, getattr(self, name)))
+
+    def get_latency_percentiles(self, qs=(50, 95, 99)):
+        """
+        To get p50/p95/p99 (in seconds) of each engine step, see lib.metrics.LatencyMetrics.percentiles().
+        Return an empty dict if the game is not instrumented.
+        """
+        if self.metrics is None:
+            return {}
+        return self.metrics.percentiles(qs)
+
+    def close_log(self):
+        """
+        To write all pending records and close the event log, normally once the game is over or closed.
+        A 'close' record is written last, so the game would not be recovered (see self.recover()) later.
+        """
+        if self.event_log is not None:
+            self.log_event('close')
+            self.event_log.close()
+
+    @classmethod
+    def recover(cls, path):
+        """
+        To rebuild a live game from its event log, e.g. after the server process is restarted.
+
+        The game is set up again with the computer players, seats and characters in the 'setup' record, then all
+        logged records are replayed (see self.replay()), so game_param, players_info and the history end up the same
+        as they were before the restart. New records are appended to the same log.
+        """
+        records = read_log(path)
+        setup = next(records, None)
+        if setup is None or setup['event'] != 'setup':
+            raise Exception(f'{path} does not start with a setup record!')
+        game_id = os.path.splitext(os.path.basename(path))[0]
+        avalon = cls(setup['nicknames'],
+                     has_percival=setup['has_percival'],
+                     has_morgana=setup['has_morgana'],
+                     has_mordred=setup['has_mordred'],
+                     has_oberon=setup['has_oberon'],
+                     has_lake_lady=setup['has_lake_lady'],
+                     platform=setup['platform'],
+                     log_dir=None,
+                     game_id=game_id,
+                     deal=setup,
+                     seed=setup.get('seed'))
+        avalon.replay(records)
+        avalon.event_log = EventLog(path)
+        avalon.log_event('recover')
+        # the new writer has not logged anything yet, it starts with a snapshot of the whole state
+        avalon.game_param.mark_changed(*avalon.game_param)
+        avalon.log_state()
+        return avalon
+
+    def replay(self, records):
+        """
+        To apply the records of an event log to this game in order.
+
+        'action' records are replayed through the action methods, 'client' records (the inputs on 'socket' platform)
+        through self.client_run(), and each 'engine' record runs one engine pass. The computer players make their moves
+        again in the engine passes, drawing from self.random as they did in the logged game, so their logged actions
+        are skipped and the generator ends up in the same state as if the game had never stopped.
+
+        If the log ends with actions or inputs after the last 'engine' record (the game stopped before the engine
+        handled them), they are left unhandled, so the next engine pass picks them up.
+        """
+        last_revision = self.revision
+        # True if an 'action' or 'client' record has been replayed since the last 'engine' record
+        unhandled = False
+        for record in records:
+            last_revision = max(last_revision, record['revision'])
+            if record['event'] in ['action', 'client']:
+                unhandled = True
+            if record['event'] == 'action':
+                if record['nickname'] in self.ai_nicknames:
+                    continue
+                # on 'socket' platform, players' actions are made again by replaying their inputs
+                if self.platform == 'socket' and record['nickname'] in self.human_nicknames:
+                    continue
+                if record['action'] not in self.replay_actions:
+                    raise Exception(f"Unknown action {record['action']} in the event log!")
+                kwargs = dict((k, v) for k, v in record.items() if k not in ['event', 'revision', 't', 'action'])
+                getattr(self, record['action'])(**kwargs)
+            elif record['event'] == 'client':
+                self.client_run(record['nickname'], record['input'])
+            elif record['event'] == 'engine':
+                # the pass may have been woken up by a change that is not logged (e.g. a player reading the next
+                # message on 'api' platform), make sure it runs again
+                self.notify_change()
+                if self.platform == 'api':
+                    self.api_server_run()
+                else:
+                    self.server_step()
+                unhandled = False
+
+        # carry on after the last logged revision, everything replayed has been handled already unless it came after
+        # the last engine pass
+        with self.change_condition:
+            self.revision = max(self.revision, last_revision + 1)
+            self.handled_revision = self.revision - 1 if unhandled else self.revision
+
     def get_vote_result(self):
         """
         To calculate the vote result and update the result to self.game_param.
         """
-        n_approve = [v for v in self.game_param['votes'].values()].count('approve')
+        n_approve = self.tally.n_approve
         if n_approve > int(self.n_players / 2):
             res = 'approved'
         else:
             res = 'rejected'
-        self.game_param['n_approve'] = n_approve
-        self.game_param['vote_result'] = res
+        self.game_param.n_approve = n_approve
+        self.game_param.vote_result = res
 
     def get_quest_result(self):
         """
         To calculate the quest result and update result to self.game_param.
         Note that the self.need_2_fail_cards is needed in here.
         """
-        n_fail = [a for a in self.game_param['attempts'].values()].count('fail')
+        n_fail = self.tally.n_fail
         res = 'success'
 
-        if n_fail > 0 or (self.need_2_fail_cards and self.game_param['quest'] == 4 and n_fail > 1):
+        if n_fail >= self.get_n_fail_needed(self.game_param.quest):
             res = 'fail'
 
-        self.game_param['n_fail'] = n_fail
-        self.game_param['quest_result'] = res
-        self.game_param['quest_results'].append(res)
+        self.game_param.n_fail = n_fail
+        self.game_param.quest_result = res
+        self.game_param.quest_results.append(res)
+        self.game_param.mark_changed('quest_results')
+        self.tally.add_quest_result(res)
 
     def handle_lake_lady(self):
         """
@@ -1102,14 +1484,14 @@ class Avalon:
         the system also will not run this function anymore until this quest is completed, where self.move_next_round()
         function is triggered and 'done_lake_lady' will be reset to None.
         """
-        if self.game_param['lake_lady'] in self.ai_nicknames:
-            target = random.choice(self.game_param['p_no_lake_lady'] + [None])
-            self.use_lake_lady_power(self.game_param['lake_lady'], target)
-        if self.game_param['lake_lady_target']:
-            target = self.game_param['lake_lady_target']
+        if self.game_param.lake_lady in self.ai_nicknames:
+            target = self.random.choice(self.game_param.p_no_lake_lady + [None])
+            self.use_lake_lady_power(self.game_param.lake_lady, target)
+        if self.game_param.lake_lady_target:
+            target = self.game_param.lake_lady_target
             reveal_side = self.players_info[target]['side']
-            self.players_info[self.game_param['lake_lady']]['knowledge'][target] = reveal_side
-            self.game_param['done_lake_lady'] = True
+            self.knowledge.reveal(self.game_param.lake_lady, target, reveal_side)
+            self.game_param.done_lake_lady = True
 
     def handle_proposal(self):
         """
@@ -1126,14 +1508,14 @@ class Avalon:
         game and the system will not run this function until this round is completed, where self.move_next_round()
         function is triggered and 'done_proposal' will be reset to None.
         """
-        if self.game_param['leader'] in self.ai_nicknames and not self.game_param['members']:
-            self.propose_quest(self.game_param['leader'], random.sample(self.nicknames, self.game_param['n_members']))
+        if self.game_param.leader in self.ai_nicknames and not self.game_param.members:
+            self.propose_quest(self.game_param.leader, self.random.sample(self.nicknames, self.game_param.n_members))
 
-        if self.game_param['members']:
-            self.game_param['p_no_attempt'] = self.game_param['members'].copy()
-            if self.game_param['round'] < 5:
-                self.game_param['p_no_vote'] = self.nicknames.copy()
-            self.game_param['done_proposal'] = True
+        if self.game_param.members:
+            self.game_param.p_no_attempt = Pool(self.game_param.members)
+            if self.game_param.round < 5:
+                self.game_param.p_no_vote = Pool(self.nicknames)
+            self.game_param.done_proposal = True
 
     def handle_vote(self):
         """
@@ -1150,15 +1532,15 @@ class Avalon:
         If the result is rejected, the game will skip 'quest' stage and straight to 'record' stage. Therefore, the
         system will record the history here for later 'record' stage.
         """
-        if any(n in self.game_param['p_no_vote'] for n in self.ai_nicknames):
+        if any(n in self.game_param.p_no_vote for n in self.ai_nicknames):
             for n in self.ai_nicknames:
-                vote = random.choice(['approve', 'reject'])
+                vote = self.random.choice(['approve', 'reject'])
                 self.vote_quest(n, 'approve')
 
-        if len(self.game_param['votes']) == len(self.nicknames):
-            self.game_param['done_vote'] = True
+        if self.tally.n_votes == self.n_players:
+            self.game_param.done_vote = True
             self.get_vote_result()
-            if self.game_param['vote_result'] == 'rejected':
+            if self.game_param.vote_result == 'rejected':
                 self.record_game_history()
 
     def handle_quest(self):
@@ -1180,25 +1562,22 @@ class Avalon:
         will move the 'end' stage which is the last stage of the game.
 
         """
-        if any(n in self.game_param['p_no_attempt'] for n in self.ai_nicknames):
-            temp_list = self.game_param['p_no_attempt'].copy()
+        if any(n in self.game_param.p_no_attempt for n in self.ai_nicknames):
+            temp_list = self.game_param.p_no_attempt.copy()
             for n in temp_list:
                 if n in self.ai_nicknames:
-                    attempt = random.choice(['success', 'fail'])
-                    if n in self.game_param['p_good']:
+                    attempt = self.random.choice(['success', 'fail'])
+                    if n in self.game_param.p_good:
                         attempt = 'success'
                     self.do_quest(n, 'success')
 
-        if len(self.game_param['attempts']) == self.game_param['n_members']:
-            self.game_param['done_quest'] = True
+        if self.tally.n_attempts == self.game_param.n_members:
+            self.game_param.done_quest = True
             self.get_quest_result()
             self.record_game_history()
-            if any(self.game_param['quest_results'].count(R := r) > 2 for r in
-                   self.game_param['quest_results']):
-                if R == 'success':
-                    self.game_param['win_3_quests'] = 'good'
-                else:
-                    self.game_param['win_3_quests'] = 'evil'
+            winner = self.tally.get_winner()
+            if winner:
+                self.game_param.win_3_quests = winner
 
     def handle_end(self):
         """
@@ -1209,63 +1588,67 @@ class Avalon:
         Check if the target is Merlin and store the value in 'assassin_success'. 'assassin_success' is to determine
         which message pack to be picked for players.
         """
-        if self.game_param['assassin'] in self.ai_nicknames:
-            target = random.choice(self.game_param['p_good'])
-            self.assassinate(self.game_param['assassin'], target)
-        if self.game_param['assassin_target'] and \
-                self.game_param['assassin_target'] == self.game_param['merlin']:
-            self.game_param['assassin_success'] = True
+        if self.game_param.assassin in self.ai_nicknames:
+            target = self.random.choice(self.game_param.p_good)
+            self.assassinate(self.game_param.assassin, target)
+        if self.game_param.assassin_target and \
+                self.game_param.assassin_target == self.game_param.merlin:
+            self.game_param.assassin_success = True
         else:
-            self.game_param['assassin_success'] = False
+            self.game_param.assassin_success = False
 
     def server_run(self):
         """
         To handle the game progress after player's action and auto make action for computer players.
 
-        This function is listening the whole game to detect if any player has made any action by checking their
-        'progress' parameter.
-        If a player made an action, his 'progress' value would be different.
+        This function is listening the whole game to detect if any player has made any action by waiting for a new
+        revision of the game (see self.wait_for_change()), then runs self.server_step() to handle it.
+        """
+        while True:
+            # Check if any player make any action
+            if self.wait_for_change(timeout=1):
+                self.server_step()
+
+                # if is end game break the loop
+                if self.end_game:
+                    break
+
+    def server_step(self):
+        """
+        To run one pass of the engine for the 'socket' platform. Nothing is done unless the game has changed since the
+        last pass.
 
+        If a player made an action, his 'progress' value would be updated and the revision goes up.
         Then determine what kind of action and handle the follow-up movement for the game.
 
         If all players are in the last message pack of the same stage, decide what is the next stage should be.
         """
-        while True:
-            # Check if any player make any action
-            if self.game_param['progress'] != self.game_param_copy['progress']:
-                # Update the old progress value
-                self.game_param_copy['progress'] = copy.deepcopy(self.game_param['progress'])
-                # log file
-                with open('../log/log', 'a') as log:
-                    log.write('server side: \n')
-                    pprint.pprint(self.game_param, log)
-                    log.write('\n')
+        if not self.start_engine_pass():
+            return
 
-                if self.has_lake_lady:
-                    if self.game_param['stage'] == 'lake_lady' and not self.game_param['done_lake_lady']:
-                        self.handle_lake_lady()
+        if self.has_lake_lady:
+            if self.game_param.stage == Stage.LAKE_LADY and not self.game_param.done_lake_lady:
+                self.handle_lake_lady()
 
-                if self.game_param['stage'] == 'proposal' and not self.game_param['done_proposal']:
-                    self.handle_proposal()
+        if self.game_param.stage == Stage.PROPOSAL and not self.game_param.done_proposal:
+            self.handle_proposal()
 
-                elif self.game_param['stage'] == 'vote' and not self.game_param['done_vote']:
-                    self.handle_vote()
+        elif self.game_param.stage == Stage.VOTE and not self.game_param.done_vote:
+            self.handle_vote()
 
-                elif self.game_param['stage'] == 'quest' and not self.game_param['done_quest']:
-                    self.handle_quest()
+        elif self.game_param.stage == Stage.QUEST and not self.game_param.done_quest:
+            self.handle_quest()
 
-                elif self.game_param['stage'] == 'end' and self.game_param['win_3_quests'] == 'good':
-                    self.handle_end()
+        elif self.game_param.stage == Stage.END and self.game_param.win_3_quests == 'good':
+            self.handle_end()
 
-                # determine if all player are in last message pack of the same stage, if yes lead them to next stage
-                if all(v['stage'] == self.game_param['stage'] and
-                       v['step'] == len(self.msg_packs[self.game_param['stage']]) - 1
-                       for k, v in self.game_param['progress'].items()):
-                    self.move_next_stage()
+        # determine if all player are in last message pack of the same stage, if yes lead them to next stage
+        if all(v['stage'] == self.game_param.stage and
+               v['step'] == len(self.msg_packs[self.game_param.stage]) - 1
+               for k, v in self.game_param.progress.items()):
+            self.move_next_stage()
 
-                # if is end game break the loop
-                if self.end_game:
-                    break
+        self.end_engine_pass()
 
     def client_run(self, nickname, input_):
         """
@@ -1284,21 +1667,18 @@ class Avalon:
         or 'done_quest'.
 
         If msg_pack does not contain 'wait' item or the 'wait' is resolved, allow player to proceed the game by calling
-        self.move_next_step() which is to update self.game_param['progress'].
+        self.move_next_step() which is to update self.game_param.progress.
 
         Then this function will return the game message.
 
         Note that this function also handle the help request from player, if player's input is starting with '?'.
         """
         # log file
-        with open('../log/log', 'a') as log:
-            log.write(f'{nickname} turn: \n')
-            pprint.pprint(self.game_param, log)
-            log.write('\n')
+        self.log_event('client', nickname=nickname, input=input_)
 
         # Handle player's help request
         if input_ and input_[0] == '?':
-            return self.get_help_msg(input_)
+            return self.get_help_msg(nickname, input_)
 
         # Get game message pack
         msg_pack = self.get_msg_pack(nickname)
@@ -1315,6 +1695,9 @@ class Avalon:
         msg = None
         if 'msg' in msg_pack.keys():
             msg = self.process_msg(nickname, msg_pack['msg'], pack_argv)
+            if 'options' in msg_pack.keys():
+                key = msg_pack['options']
+                msg += self.get_options(key, self.game_param if key in self.game_param else None)
 
         # Check if player is allowed to proceed their game with next step
         if 'wait' not in msg_pack.keys() or self.game_param[msg_pack['wait']]:
@@ -1325,43 +1708,56 @@ class Avalon:
     def get_msg_pack(self, nickname):
         """
         To get msg_pack from self.msg_packs based on player's progress.
-        If 'condition' is found, check if the player's or game info are met the condition.
+        If 'condition' is found (pre-compiled by self.prepare_msg_packs()), check if the player's or game info are met
+        the condition.
         If yes, return the msg_pack, otherwise look into next message by adding 1 to player's step.
         """
         while True:
-            stage = self.game_param['progress'][nickname]['stage']
-            step = self.game_param['progress'][nickname]['step']
+            stage = self.game_param.progress[nickname]['stage']
+            step = self.game_param.progress[nickname]['step']
             msg_pack = self.msg_packs[stage][step]
             if 'condition' not in msg_pack.keys() or eval(msg_pack['condition']):
                 break
-            self.game_param['progress'][nickname]['step'] += 1
+            self.game_param.progress[nickname]['step'] += 1
+            self.game_param.mark_changed('progress')
+            self.notify_change()
         return msg_pack
 
+    def needs_input(self, nickname):
+        """
+        To check if the next message pack of the player handles an 'event', i.e. the next self.client_run() call of
+        the player should come with his input. Unlike self.get_msg_pack(), the player's progress is not moved.
+        """
+        progress = self.game_param.progress[nickname]
+        for msg_pack in self.msg_packs[progress['stage']][progress['step']:]:
+            if 'condition' not in msg_pack.keys() or eval(msg_pack['condition']):
+                return 'event' in msg_pack.keys()
+        return False
+
     def process_msg(self, nickname, pack_msg, pack_argv):
         """
         To process the 'msg' item in msg_pack.
         There are 2 types in 'msg' item. One is the function that generates the message content, and another
         one is a pure message content in string format with parameters.
 
-        If 'msg' is a function, extract the required argv name by using inspect lib and compare with self.game_param.
-        If there is a match, store the argv name and the value from self.game_param as dict.
+        If 'msg' is a function, get the required argv names from its call plan (see self.get_call_plan()) and look them
+        up in self.game_param. Store the argv name and the value from self.game_param as dict.
         Note that 'nickname' is not in self.game_param so the system manually add 'nickname' to the dict.
         Execute the function and pass the dict as argument(s) to get the message content.
 
-        If 'msg' is pure string, extract all the parameters in the string by using re lib. Pass all the extracted
+        If 'msg' is pure string, get all the parameters in the string (see self.get_format_fields()). Pass all the
         parameters to self.get_value_for_msg() to get the corresponding value and store as dict.
         Then format the string with the dict to get the message content.
         """
         # is function
         if inspect.ismethod(pack_msg):
-            # Get parameter names from the function and check if they are in self.game_param
+            # Get the parameter names that are in self.game_param from the cached call plan of the function
             # Get the value from self.game_param with the corresponding parameters
             # Combine the parameter name and value as argv dict
-            argv = dict((k, self.game_param[k])
-                        for k in [a.name for a in inspect.signature(pack_msg).parameters.values()]
-                        if k in self.game_param.keys())
+            plan = self.get_call_plan(pack_msg)
+            argv = dict((k, self.game_param[k]) for k in plan['game_param_keys'])
             # Manually add 'nickname' if it is required in the function
-            if 'nickname' in [a.name for a in inspect.signature(pack_msg).parameters.values()]:
+            if plan['nickname']:
                 argv['nickname'] = nickname
             argv.update(pack_argv)
             # Execute the function with argv dict
@@ -1369,8 +1765,7 @@ class Avalon:
         else:
             # Extract the parameter from string and get the value
             # Combine the parameter name and value as argv dict
-            argv = dict((k, self.get_value_for_msg(k, nickname))
-                        for k in list(map(lambda m: m[1:-1], re.findall(r'{.*?}', pack_msg))))
+            argv = dict((k, self.get_value_for_msg(k, nickname)) for k in self.get_format_fields(pack_msg))
             # Format the string with argv dict
             msg = pack_msg.format(**argv)
         return msg
@@ -1379,15 +1774,15 @@ class Avalon:
         """
         To process 'event' item in msg_pack.
 
-        'event' item only contains function name. Therefore, extract the parameter names from function by using inspect
-        lib and compare with self.game_param to get their values. Then store the names, values pair as argv dict.
+        'event' item only contains function name. Therefore, get the parameter names from its call plan (see
+        self.get_call_plan()) and look them up in self.game_param. Then store the names, values pair as argv dict.
 
         Manually add 'nickname' to argv dict if 'nickname' is required in the event function.
 
-        System has kept 3 attributes for handling the input for all event functions which are input format, options and
+        System has kept 3 attributes for handling the input for all event functions which are validator, options and
         target.
 
-        'input_format' is re pattern in string format for input validation.
+        'validator' is the cached re pattern for input validation, see get_input_validator().
 
         'options' is to determine which is the corresponding options list for getting the value. For instance if the
         input is '1' and the options is self.vote_cards (value is ['approve', 'reject']), the corresponding value then
@@ -1395,70 +1790,72 @@ class Avalon:
 
         'target' is to point the target parameter of the event function for this input.
 
-        Then system will validate the input by using re.match with 'input_format'
-        If yes, get the value from the 'options' list based on the input and update the argv dict with 'target'.
+        Then system will validate and parse the input by using parse_input() with 'validator'.
+        If valid, get the value from the 'options' list based on the picked indices and update the argv dict with
+        'target'.
         Then execute the event function with argv dict.
         If the input is not valid, return error message and ask the player to key in the input again.
         """
         error_msg = None
-        input_format = None
+        validator = None
         options = None
         target = None
 
         # Get parameter names from the function and check if they are in self.game_param
         # Get the value from self.game_param with the corresponding parameters
         # Combine the parameter name and value as argv dict
-        argv = dict((a.name, self.game_param[a.name] if a.name in self.game_param.keys() else None)
-                    for a in inspect.signature(pack_event).parameters.values())
+        plan = self.get_call_plan(pack_event)
+        argv = dict.fromkeys(plan['params'])
+        argv.update((k, self.game_param[k]) for k in plan['game_param_keys'])
 
         # Manually add nickname to argv dict
-        if 'nickname' in [a.name for a in inspect.signature(pack_event).parameters.values()]:
+        if plan['nickname']:
             argv['nickname'] = nickname
         argv.update(pack_argv)
 
-        # Get input_format, options and target based on event function name
+        # Get validator, options and target based on event function name
         if pack_event == self.propose_quest:
-            input_format = r'^(?!.*(.\s).*\1)([0-' + f'{self.n_players - 1}' + \
-                           r']\s){' + f'{self.game_param["n_members"]}' + r'}$'
+            validator = get_input_validator(self.n_players, self.game_param.n_members)
             options = self.nicknames
             target = 'members'
 
         elif pack_event == self.vote_quest:
-            input_format = r'^[0-1]\s*$'
+            validator = get_input_validator(len(self.vote_cards))
             options = self.vote_cards
             target = 'vote'
 
         elif pack_event == self.do_quest:
-            if nickname in self.game_param['p_evil']:
-                input_format = r'^[0-1]\s*$'
+            if nickname in self.game_param.p_evil:
+                validator = get_input_validator(len(self.quest_cards))
                 options = self.quest_cards
                 target = 'attempt'
             else:
                 argv['attempt'] = 'success'
 
         elif pack_event == self.assassinate:
-            input_format = r'^[0-' + str(int(len(self.game_param['p_good']) - 1)) + r']\s*$'
-            options = self.game_param['p_good']
+            validator = get_input_validator(len(self.game_param.p_good))
+            options = self.game_param.p_good
             target = 'target'
 
         elif pack_event == self.use_lake_lady_power:
-            input_format = r'^[0-' + str(int(len(self.game_param['p_no_lake_lady']) - 1)) + r'x]\s*$'
-            options = self.game_param['p_no_lake_lady']
+            validator = get_input_validator(len(self.game_param.p_no_lake_lady), allow_skip=True)
+            options = self.game_param.p_no_lake_lady
             target = 'target'
 
         # Validate input
-        if all(input_info for input_info in [input_format, options, target]):
-            if re.match(input_format, input_.strip() + ' '):
+        if all(input_info for input_info in [validator, options, target]):
+            picks = parse_input(validator, input_)
+            if picks is not None:
                 # input is valid, get input corresponding value in proper format (string or list)
-                if len(input_.strip().split()) == 1:
+                if len(picks) == 1:
                     # input == 'x' is specifically for lake lady action, where x means does not use the power
                     # so the value is nickname of the lake lady
-                    if input_.strip() == 'x':
+                    if picks[0] is None:
                         value = None
                     else:
-                        value = options[int(input_.strip())]
+                        value = options[picks[0]]
                 else:
-                    value = [options[int(i)] for i in input_.strip().split()]
+                    value = [options[i] for i in picks]
                 # update argv dict
                 argv[target] = value
 
@@ -1472,6 +1869,39 @@ class Avalon:
 
         return error_msg
 
+    def get_call_plan(self, func):
+        """
+        To get the binding plan of a 'msg' function or 'event' function in msg_pack, which contains:
+
+        'params': names of all parameters of the function.
+        'game_param_keys': names of parameters that could be looked up in self.game_param.
+        'nickname': if the function requires 'nickname', which is not in self.game_param.
+
+        Plans are built once when the message packs are generated and then reused, so the function signature is not
+        inspected again for every message.
+        """
+        plan = self.call_plans.get(func)
+        if plan is None:
+            params = [a.name for a in inspect.signature(func).parameters.values()]
+            plan = {
+                'params': params,
+                'game_param_keys': [k for k in params if k in self.game_param.keys()],
+                'nickname': 'nickname' in params
+            }
+            self.call_plans[func] = plan
+        return plan
+
+    def get_format_fields(self, template):
+        """
+        To get the parameter names in a 'msg' string, e.g. ['members', 'quest'] for
+        'You have selected {members} to do quest {quest}.'. The result is cached per string.
+        """
+        fields = self.format_fields.get(template)
+        if fields is None:
+            fields = list(map(lambda m: m[1:-1], re.findall(r'{.*?}', template)))
+            self.format_fields[template] = fields
+        return fields
+
     def move_next_step(self, nickname):
         """
         To handle player's progress.
@@ -1489,14 +1919,18 @@ class Avalon:
         same last msg_pack, then self.server_run() could detect this and move the system stage to next stage by calling
         self.move_next_stage().
         """
-        stage = self.game_param['progress'][nickname]['stage']
-        step = self.game_param['progress'][nickname]['step']
-        if stage != self.game_param['stage']:
-            self.game_param['progress'][nickname]['stage'] = self.game_param['stage']
-            self.game_param['progress'][nickname]['step'] = 0
+        stage = self.game_param.progress[nickname]['stage']
+        step = self.game_param.progress[nickname]['step']
+        if stage != self.game_param.stage:
+            self.game_param.progress[nickname]['stage'] = self.game_param.stage
+            self.game_param.progress[nickname]['step'] = 0
+            self.game_param.mark_changed('progress')
+            self.notify_change()
         else:
             if step < len(self.msg_packs[stage]) - 1:
-                self.game_param['progress'][nickname]['step'] += 1
+                self.game_param.progress[nickname]['step'] += 1
+                self.game_param.mark_changed('progress')
+                self.notify_change()
 
     def move_next_stage(self):
         """
@@ -1538,34 +1972,34 @@ class Avalon:
         not use her power on 1st quest.
         """
         if self.platform == 'socket':
-            if self.game_param['stage'] == 'record' and not self.game_param['win_3_quests']:
+            if self.game_param.stage == Stage.RECORD and not self.game_param.win_3_quests:
                 self.move_next_round()
-                self.game_param['stage'] = 'proposal'
+                self.game_param.stage = Stage.PROPOSAL
                 if self.has_lake_lady:
-                    if self.game_param['quest'] > 2 and not self.game_param['done_lake_lady']:
-                        self.game_param['stage'] = 'lake_lady'
-            elif self.game_param['stage'] == 'vote' and self.game_param['vote_result'] == 'rejected':
-                self.game_param['stage'] = 'record'
-            elif self.game_param['stage'] == 'proposal' and self.game_param['round'] == 5:
-                self.game_param['stage'] = 'quest'
-            elif self.has_lake_lady and self.game_param['stage'] == 'init':
-                self.game_param['stage'] = 'proposal'
-            elif self.game_param['stage'] != self.stages[-1]:
-                self.game_param['stage'] = self.stages[self.stages.index(self.game_param['stage']) + 1]
+                    if self.game_param.quest > 2 and not self.game_param.done_lake_lady:
+                        self.game_param.stage = Stage.LAKE_LADY
+            elif self.game_param.stage == Stage.VOTE and self.game_param.vote_result == 'rejected':
+                self.game_param.stage = Stage.RECORD
+            elif self.game_param.stage == Stage.PROPOSAL and self.game_param.round == 5:
+                self.game_param.stage = Stage.QUEST
+            elif self.has_lake_lady and self.game_param.stage == Stage.INIT:
+                self.game_param.stage = Stage.PROPOSAL
+            elif self.game_param.stage != self.stages[-1]:
+                self.game_param.stage = self.stages[self.stages.index(self.game_param.stage) + 1]
             else:
                 self.end_game = True
         else:
-            if (self.game_param['stage'] == 'vote' and self.game_param['vote_result'] == 'rejected') or \
-                    (self.game_param['stage'] == 'quest' and not self.game_param['win_3_quests']):
+            if (self.game_param.stage == Stage.VOTE and self.game_param.vote_result == 'rejected') or \
+                    (self.game_param.stage == Stage.QUEST and not self.game_param.win_3_quests):
                 self.move_next_round()
-                self.game_param['stage'] = 'speak'
+                self.game_param.stage = Stage.SPEAK
                 if self.has_lake_lady:
-                    if self.game_param['quest'] > 2 and not self.game_param['done_lake_lady']:
-                        self.game_param['stage'] = 'lake_lady'
-            elif self.game_param['stage'] == 'proposal' and self.game_param['round'] == 5:
-                self.game_param['stage'] = 'quest'
-            elif self.game_param['stage'] != self.stages[-1]:
-                self.game_param['stage'] = self.stages[self.stages.index(self.game_param['stage']) + 1]
+                    if self.game_param.quest > 2 and not self.game_param.done_lake_lady:
+                        self.game_param.stage = Stage.LAKE_LADY
+            elif self.game_param.stage == Stage.PROPOSAL and self.game_param.round == 5:
+                self.game_param.stage = Stage.QUEST
+            elif self.game_param.stage != self.stages[-1]:
+                self.game_param.stage = self.stages[self.stages.index(self.game_param.stage) + 1]
             else:
                 self.end_game = True
 
@@ -1583,60 +2017,55 @@ class Avalon:
         Otherwise, it would be a new quest, 'quest' += 1 and 'round' would be back to 1.
 
         Note that if lady of the lake is included, and it is a new quest, the new lady of the lake would be the player
-        who was the target of last lady of the lake. And the system will reset the value 'done_lake_lady' and
-        'lake_lady_target' to None.
+        who was the target of last lady of the lake, and 'lake_lady_target' is reset to None. 'done_lake_lady' is reset
+        to None even if she did not use her power, so she could use it in the next quest.
         """
-        if self.game_param['quest_result'] is None:
-            self.game_param['round'] += 1
-        else:
-            self.game_param['quest'] += 1
-            self.game_param['round'] = 1
-            self.game_param['n_members'] = self.quests[self.game_param['quest'] - 1]
-            self.game_records[self.game_param['quest']] = []
-
-            if self.has_lake_lady and self.game_param['lake_lady_target']:
-                self.game_param['done_lake_lady'] = None
-                self.game_param['lake_lady'] = self.game_param['lake_lady_target']
-                self.game_param['lake_lady_target'] = None
-
-        if self.game_param['leader'] == self.p_positions[-1]:
-            self.game_param['leader'] = self.p_positions[0]
+        if self.game_param.quest_result is None:
+            self.game_param.round += 1
         else:
-            self.game_param['leader'] = self.p_positions[self.p_positions.index(self.game_param['leader']) + 1]
-
-        i = self.p_positions.index(self.game_param['leader'])
-        self.game_param['speaker'] = N if any((N := n) for n in self.p_positions[i:] + self.p_positions[:i]
-                                              if n in self.human_nicknames) else ''
-        self.game_param['p_no_speak'] = [n for n in self.p_positions[i:] + self.p_positions[:i]
-                                         if n in self.human_nicknames][1:]
-        self.game_param['done_speak'] = None
-        self.game_param['members'] = []
-        self.game_param['done_proposal'] = None
-        self.game_param['votes'] = {}
-        self.game_param['p_no_vote'] = []
-        self.game_param['done_vote'] = None
-        self.game_param['n_approve'] = None
-        self.game_param['vote_result'] = None
-        self.game_param['attempts'] = {}
-        self.game_param['p_no_attempt'] = []
-        self.game_param['done_quest'] = None
-        self.game_param['n_fail'] = None
-        self.game_param['quest_result'] = None
-        self.game_param['new_round'] = True
+            self.game_param.quest += 1
+            self.game_param.round = 1
+            self.game_param.n_members = self.quests[self.game_param.quest - 1]
+
+            if self.has_lake_lady:
+                self.game_param.done_lake_lady = None
+                if self.game_param.lake_lady_target:
+                    self.game_param.lake_lady = self.game_param.lake_lady_target
+                    self.game_param.lake_lady_target = None
+
+        self.game_param.leader = self.seats.next(self.game_param.leader)
+        self.game_param.p_no_speak = self.seats.get_speakers(self.game_param.leader)
+        self.game_param.speaker = self.game_param.p_no_speak.popleft() if self.game_param.p_no_speak else ''
+        self.game_param.done_speak = None
+        self.game_param.members = []
+        self.game_param.done_proposal = None
+        self.game_param.votes = {}
+        self.game_param.p_no_vote = Pool()
+        self.game_param.done_vote = None
+        self.game_param.n_approve = None
+        self.game_param.vote_result = None
+        self.game_param.attempts = {}
+        self.tally.new_round()
+        self.game_param.p_no_attempt = Pool()
+        self.game_param.done_quest = None
+        self.game_param.n_fail = None
+        self.game_param.quest_result = None
+        self.game_param.new_round = True
 
     def record_game_history(self):
         game_record = dict((k, self.game_param[k]) for k in self.game_record_keys if k in self.game_param)
-        self.game_records[self.game_param['quest']].append(game_record)
+        self.history.append(game_record)
+        self.records_renderer.append()
 
-    def get_help_msg(self, input_):
+    def get_help_msg(self, nickname, input_):
         if input_.strip() == '?cheat':
-            help_msg = pprint.pformat(self.game_param, indent=4)
+            help_msg = pprint.pformat(self.game_param.as_dict(), indent=4)
         elif input_.strip() == '?game':
             help_msg = self.show_game_info()
         elif input_.strip() == '?player':
-            help_msg = self.show_players_info(self.game_param['nickname'])
+            help_msg = self.show_players_info(nickname)
         elif input_.strip() == '?history':
-            help_msg = self.show_game_records()
+            help_msg = self.show_game_records(nickname)
         else:
             help_msg = '?game = print game info\n' \
                        '?player = print player info\n' \
@@ -1644,38 +2073,41 @@ class Avalon:
         return help_msg
 
     def api_server_run(self):
-        n_calls = sum(map(lambda calls: len(calls), [l for _, l in self.game_param['client_calls'].items()]))
-        if n_calls != self.client_calls_count:
+        """
+        To handle the game progress for the 'api' platform (Panel UI). Nothing is done unless the game has changed since
+        the last call, so this could be called after every self.wait_for_change().
+        """
+        if not self.start_engine_pass():
+            return
 
-            self.client_calls_count = n_calls
-            if self.has_lake_lady:
-                if self.game_param['stage'] == 'lake_lady' and not self.game_param['done_lake_lady']:
-                    self.handle_lake_lady()
-            if self.game_param['stage'] == 'speak' and not self.game_param['done_speak']:
-                print('handle speaker')
-                if not self.game_param['speaker'] and self.game_param['p_no_speak']:
-                    self.game_param['speaker'] = self.game_param['p_no_speak'].pop(0)
-                else:
-                    self.game_param['done_speak'] = True
-            elif self.game_param['stage'] == 'proposal' and not self.game_param['done_proposal']:
-                print('handle proposal')
-                self.handle_proposal()
+        if self.has_lake_lady:
+            if self.game_param.stage == Stage.LAKE_LADY and not self.game_param.done_lake_lady:
+                self.handle_lake_lady()
+        if self.game_param.stage == Stage.SPEAK and not self.game_param.done_speak:
+            print('handle speaker')
+            if not self.game_param.speaker and self.game_param.p_no_speak:
+                self.game_param.speaker = self.game_param.p_no_speak.popleft()
+                self.game_param.mark_changed('p_no_speak')
+            else:
+                self.game_param.done_speak = True
+        elif self.game_param.stage == Stage.PROPOSAL and not self.game_param.done_proposal:
+            print('handle proposal')
+            self.handle_proposal()
 
-            elif self.game_param['stage'] == 'vote' and not self.game_param['done_vote']:
-                print('handle vote')
-                self.handle_vote()
+        elif self.game_param.stage == Stage.VOTE and not self.game_param.done_vote:
+            print('handle vote')
+            self.handle_vote()
 
-            elif self.game_param['stage'] == 'quest' and not self.game_param['done_quest']:
-                print('handle quest')
-                self.handle_quest()
+        elif self.game_param.stage == Stage.QUEST and not self.game_param.done_quest:
+            print('handle quest')
+            self.handle_quest()
 
-            elif self.game_param['stage'] == 'end' and not self.end_game:
-                print('handle end')
-                self.handle_end()
+        elif self.game_param.stage == Stage.END and not self.end_game:
+            print('handle end')
+            self.handle_end()
 
-            with open('log/log', 'a') as log:
-                pprint.pprint(self.game_param, log)
+        if self.game_param.stage == Stage.LAKE_LADY or \
+                self.game_param.is_stage_done():
+            self.move_next_stage()
 
-            if self.game_param['stage'] == 'lake_lady' or \
-                    (self.game_param['stage'] != 'end' and self.game_param[f"done_{self.game_param['stage']}"]):
-                self.move_next_stage()
+        self.end_engine_pass()
@@ -0,0 +1,174 @@
+"""
+Columnar store of the game history, one row per round of a game.
+
+This is where a game keeps its records (see Avalon.record_game_history()), the game records table is rendered from it
+too (see lib.render.RecordsRenderer). Every field of the records is a column of a preallocated NumPy structured array,
+so recording a round is a single row write. Players are referred to by their seat position (index of p_positions), and
+sets of players, like the members of a proposal or the players who approved it, are bitmasks with bit i for the player
+at position i. The votes and attempts of a round are copied into the bitmasks when the round is recorded, so the
+history doesn't hold on to any game_param object.
+
+eg:
+history.proposals_with('ann')      # rows of the proposals 'ann' was a member of
+history.approve_rates()            # {nickname: approve rate}
+history['members'] & history.mask(['ann', 'bob'])
+"""
+import numpy as np
+
+NONE = -1
+# codes of vote_result and quest_result
+REJECTED = 0
+APPROVED = 1
+FAIL = 0
+SUCCESS = 1
+VOTE_RESULTS = {'rejected': REJECTED, 'approved': APPROVED}
+QUEST_RESULTS = {'fail': FAIL, 'success': SUCCESS}
+VOTE_RESULT_NAMES = dict((v, k) for k, v in VOTE_RESULTS.items())
+QUEST_RESULT_NAMES = dict((v, k) for k, v in QUEST_RESULTS.items())
+
+DTYPE = np.dtype([('quest', np.int8),
+                  ('round', np.int8),
+                  ('leader', np.int8),
+                  ('members', np.uint16),
+                  ('lake_lady', np.int8),
+                  ('lake_lady_target', np.int8),
+                  ('voted', np.uint16),
+                  ('approves', np.uint16),
+                  ('n_approve', np.int8),
+                  ('vote_result', np.int8),
+                  ('attempted', np.uint16),
+                  ('fails', np.uint16),
+                  ('n_fail', np.int8),
+                  ('quest_result', np.int8)])
+CAPACITY = 25
+# empty rows to copy for every game, so a new history is one allocation
+EMPTY_ROWS = np.zeros(CAPACITY, dtype=DTYPE)
+
+
+class GameHistory:
+    def __init__(self, p_positions):
+        """
+        Rows for 5 quests of up to 5 rounds are allocated up front, they are doubled if a game ever needs more.
+        """
+        if len(p_positions) > 16:
+            raise Exception('The game history could not hold more than 16 players!')
+        self.p_positions = list(p_positions)
+        self.index = dict((nickname, i) for i, nickname in enumerate(self.p_positions))
+        self.n = 0
+        self.rows = EMPTY_ROWS.copy()
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, field):
+        """
+        To get the column of a field, with one value for each round recorded so far.
+        """
+        return self.rows[field][:self.n]
+
+    def mask(self, nicknames):
+        mask = 0
+        for nickname in nicknames:
+            mask |= 1 << self.index[nickname]
+        return mask
+
+    def nicknames(self, mask):
+        return [n for i, n in enumerate(self.p_positions) if int(mask) >> i & 1]
+
+    def seat(self, nickname):
+        return self.index[nickname] if nickname is not None else NONE
+
+    def nickname(self, seat):
+        return self.p_positions[seat] if seat != NONE else None
+
+    def append(self, record):
+        """
+        To add a round from a game record of Avalon.record_game_history().
+        """
+        if self.n == len(self.rows):
+            self.rows = np.concatenate([self.rows, np.zeros(len(self.rows), dtype=DTYPE)])
+
+        votes = record.get('votes') or {}
+        attempts = record.get('attempts') or {}
+        # in the order of DTYPE
+        self.rows[self.n] = (record['quest'],
+                             record['round'],
+                             self.seat(record['leader']),
+                             self.mask(record['members']),
+                             self.seat(record.get('lake_lady')),
+                             self.seat(record.get('lake_lady_target')),
+                             self.mask(votes),
+                             self.mask(n for n, v in votes.items() if v == 'approve'),
+                             record['n_approve'] if record['n_approve'] is not None else NONE,
+                             VOTE_RESULTS.get(record['vote_result'], NONE),
+                             self.mask(attempts),
+                             self.mask(n for n, a in attempts.items() if a == 'fail'),
+                             record['n_fail'] if record['n_fail'] is not None else NONE,
+                             QUEST_RESULTS.get(record['quest_result'], NONE))
+        self.n += 1
+
+    def get_record(self, i):
+        """
+        To get the i-th round back as a game record of Avalon.record_game_history(), e.g. to render it. Players of
+        'members', 'votes' and 'attempts' come in seat order.
+        """
+        if not 0 <= i < self.n:
+            raise IndexError(f'There is no round {i} in the game history!')
+        row = self.rows[i]
+        approves = int(row['approves'])
+        fails = int(row['fails'])
+        return {
+            'quest': int(row['quest']),
+            'round': int(row['round']),
+            'leader': self.nickname(row['leader']),
+            'members': self.nicknames(row['members']),
+            'lake_lady': self.nickname(row['lake_lady']),
+            'lake_lady_target': self.nickname(row['lake_lady_target']),
+            'votes': dict((n, 'approve' if approves >> self.index[n] & 1 else 'reject')
+                          for n in self.nicknames(row['voted'])),
+            'n_approve': int(row['n_approve']) if row['n_approve'] != NONE else None,
+            'vote_result': VOTE_RESULT_NAMES.get(int(row['vote_result'])),
+            'attempts': dict((n, 'fail' if fails >> self.index[n] & 1 else 'success')
+                             for n in self.nicknames(row['attempted'])),
+            'n_fail': int(row['n_fail']) if row['n_fail'] != NONE else None,
+            'quest_result': QUEST_RESULT_NAMES.get(int(row['quest_result']))
+        }
+
+    def bits(self, field):
+        """
+        To unpack a bitmask column into a (rounds, players) bool matrix.
+        """
+        return (self[field][:, None] >> np.arange(len(self.p_positions), dtype=np.uint16)) & 1 > 0
+
+    def proposals_with(self, nickname):
+        """
+        To get the rows of all proposals that included the player.
+        """
+        return np.flatnonzero(self['members'] & (1 << self.index[nickname]))
+
+    def proposals_by(self, nickname):
+        """
+        To get the rows of all proposals made by the player as the leader.
+        """
+        return np.flatnonzero(self['leader'] == self.index[nickname])
+
+    def approve_rates(self):
+        """
+        To calculate the rate each player approved the proposals they voted on, None if they haven't voted yet.
+        """
+        n_voted = self.bits('voted').sum(axis=0)
+        n_approved = self.bits('approves').sum(axis=0)
+        return dict((n, float(n_approved[i] / n_voted[i]) if n_voted[i] else None)
+                    for i, n in enumerate(self.p_positions))
+
+    def fail_counts(self):
+        """
+        To count the fail cards each player has played.
+        """
+        return dict(zip(self.p_positions, self.bits('fails').sum(axis=0).tolist()))
+
+    def quest_rows(self):
+        """
+        To get the rows of the rounds that went on a quest.
+        """
+        return np.flatnonzero(self['quest_result'] != NONE)
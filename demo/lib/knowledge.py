@@ -0,0 +1,98 @@
+"""
+Knowledge of the players about each other, stored as an int8 matrix indexed by seat position.
+
+knowledge.matrix[i, j] is what the player at position i knows about the player at position j, one of UNKNOWN, GOOD,
+EVIL or EITHER (see Avalon.get_players_info() for the rules). players_info[nickname]['knowledge'] is a KnowledgeRow,
+which still reads and writes like the old {nickname: 'good', ...} dict.
+"""
+from collections.abc import MutableMapping
+import numpy as np
+
+UNKNOWN = 0
+GOOD = 1
+EVIL = 2
+EITHER = 3
+LABELS = ('unknown', 'good', 'evil', 'either')
+CODES = dict((label, code) for code, label in enumerate(LABELS))
+
+
+class Knowledge:
+    def __init__(self, p_positions, characters, good_characters, has_morgana=False, has_mordred=False,
+                 has_oberon=False):
+        """
+        To build the knowledge matrix with vectorized role masks.
+        p_positions and characters are both in seat order, i.e. the player at p_positions[i] holds characters[i].
+        """
+        self.p_positions = list(p_positions)
+        self.index = dict((nickname, i) for i, nickname in enumerate(self.p_positions))
+
+        characters = np.array(characters)
+        good = np.isin(characters, list(good_characters))
+        sides = np.where(good, GOOD, EVIL).astype(np.int8)
+        matrix = np.full((len(characters), len(characters)), UNKNOWN, dtype=np.int8)
+
+        # evil players know everyone's side, unless *oberon* is hiding among the good players
+        if has_oberon:
+            evil_view = np.where((characters == 'oberon') | good, UNKNOWN, sides)
+        else:
+            evil_view = sides
+        matrix[~good] = evil_view
+        # *oberon* knows nothing
+        matrix[characters == 'oberon'] = UNKNOWN
+
+        # *merlin* knows everyone's side, unless *mordred* is hiding among the good players
+        if has_mordred:
+            merlin_view = np.where((characters == 'mordred') | good, UNKNOWN, sides)
+        else:
+            merlin_view = sides
+        matrix[characters == 'merlin'] = merlin_view
+
+        # *percival* only knows *merlin*/*morgana*, but not who is who if *morgana* is in the game
+        merlin_or_morgana = np.isin(characters, ['merlin', 'morgana'])
+        percival_view = np.where(merlin_or_morgana, EITHER if has_morgana else sides, UNKNOWN)
+        matrix[characters == 'percival'] = percival_view
+
+        self.matrix = matrix
+        # goes up by one on every change of the matrix, so renders of it know when they are stale
+        self.version = 0
+
+    def row(self, nickname):
+        return KnowledgeRow(self, self.index[nickname])
+
+    def reveal(self, nickname, target, side):
+        """
+        To let a player know the side of the target, e.g. after lady of the lake used her power.
+        """
+        self.matrix[self.index[nickname], self.index[target]] = CODES[side]
+        self.version += 1
+
+
+class KnowledgeRow(MutableMapping):
+    """
+    The knowledge of one player, as a {nickname: 'good'/'evil'/'unknown'/'either'} mapping in seat order.
+    Writes go straight to the matrix.
+    """
+    __slots__ = ('knowledge', 'i')
+
+    def __init__(self, knowledge, i):
+        self.knowledge = knowledge
+        self.i = i
+
+    def __getitem__(self, nickname):
+        return LABELS[self.knowledge.matrix[self.i, self.knowledge.index[nickname]]]
+
+    def __setitem__(self, nickname, side):
+        self.knowledge.matrix[self.i, self.knowledge.index[nickname]] = CODES[side]
+        self.knowledge.version += 1
+
+    def __delitem__(self, nickname):
+        raise TypeError('Knowledge of a player could not be deleted')
+
+    def __iter__(self):
+        return iter(self.knowledge.p_positions)
+
+    def __len__(self):
+        return len(self.knowledge.p_positions)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,223 @@
+"""
+Latency histograms for the hot paths of the game engine.
+
+A LatencyHistogram counts durations in fixed, logarithmically spaced buckets (about 12% wide, from 1 microsecond to
+100 seconds), so recording a duration is a bisect and an increment, and memory does not grow with the n of calls.
+Percentiles are estimated from the buckets, which is accurate enough to tell a 50us pass from a 5ms one.
+
+LatencyMetrics keeps one histogram per name, e.g. per engine step, and could time any function with timed().
+See Avalon(instrument=True) for how the engine is instrumented.
+
+ServerMetrics counts what happens in a server process hosting many rooms, render_metrics() exports it together with the
+rooms in Prometheus text format and serve_metrics() serves it over HTTP for a scraper.
+"""
+from bisect import bisect_left
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+# upper bounds of the buckets in seconds, 20 buckets per power of 10
+BUCKET_BOUNDS = tuple(10 ** (i / 20) * 1e-6 for i in range(20 * 8 + 1))
+
+
+class LatencyHistogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        # the last bucket is for durations above BUCKET_BOUNDS[-1]
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """
+        To add the counts of another histogram to this one, e.g. to sum up the histograms of all games.
+        """
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """
+        To estimate the q-th percentile (0 to 100) in seconds, as the upper bound of the bucket it falls in.
+        Return None if nothing has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+
+class LatencyMetrics:
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def timed(self, name, func):
+        """
+        To wrap a function so every call is timed and recorded under the name.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(name, time.perf_counter() - start)
+        return wrapper
+
+    def merge(self, other):
+        """
+        To add all histograms of another LatencyMetrics to this one.
+        """
+        with other.lock:
+            histograms = {}
+            for name, histogram in other.histograms.items():
+                histograms[name] = LatencyHistogram()
+                histograms[name].merge(histogram)
+        with self.lock:
+            for name, histogram in histograms.items():
+                self.histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+
+    def percentiles(self, qs=(50, 95, 99)):
+        """
+        To summarize every histogram as {name: {'count': n, 'mean': s, 'p50': s, 'p95': s, 'p99': s, 'max': s}}, all
+        durations in seconds.
+        """
+        summary = {}
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                summary[name] = {
+                    'count': histogram.count,
+                    'mean': histogram.total / histogram.count if histogram.count else None,
+                    **dict((f'p{q}', histogram.percentile(q)) for q in qs),
+                    'max': histogram.max
+                }
+        return summary
+
+
+class ServerMetrics:
+    """
+    Counters and latency histograms of a server process hosting many rooms, see render_metrics() for the export.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+        # latency of the engine steps of all games (see Avalon(instrument=...)) and of the UI callbacks
+        self.latency = LatencyMetrics()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_metric(name, metric_type, help_, samples):
+    """
+    To format one metric in Prometheus text exposition format. samples is a list of (labels dict, value).
+    """
+    lines = [f'# HELP {name} {help_}', f'# TYPE {name} {metric_type}']
+    for labels, value in samples:
+        label_str = ','.join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+        lines.append(f'{name}{{{label_str}}} {value}' if label_str else f'{name} {value}')
+    return lines
+
+
+def format_summary(name, help_, histograms, label, qs=(50, 95, 99)):
+    """
+    To format histograms ({label value: LatencyHistogram}) as a Prometheus summary with quantiles, sum and count.
+    """
+    lines = [f'# HELP {name} {help_}', f'# TYPE {name} summary']
+    for key, histogram in sorted(histograms.items()):
+        key = escape_label(key)
+        for q in qs:
+            value = histogram.percentile(q)
+            lines.append(f'{name}{{{label}="{key}",quantile="{q / 100}"}} {value if value is not None else "NaN"}')
+        lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.total}')
+        lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+    return lines
+
+
+def render_metrics(manager):
+    """
+    To export the rooms and games of a RoomManager (lib.room) and its ServerMetrics in Prometheus text format.
+    """
+    metrics = manager.metrics
+    rooms = manager.list_rooms()
+    games = [room.avalon for room in rooms if room.avalon is not None]
+    with metrics.latency.lock:
+        histograms = dict(metrics.latency.histograms)
+    ui_histograms = dict((k, v) for k, v in histograms.items() if k in ['auto_callback'])
+    engine_histograms = dict((k, v) for k, v in histograms.items() if k not in ui_histograms)
+
+    lines = []
+    lines += format_metric('avalon_rooms', 'gauge', 'Rooms open on this server.', [({}, len(rooms))])
+    lines += format_metric('avalon_games', 'gauge', 'Rooms with a game in progress.', [({}, len(games))])
+    lines += format_metric('avalon_room_sessions', 'gauge', 'Browser sessions in each room.',
+                           [({'room': room.room_id}, len(room.sessions)) for room in rooms])
+    lines += format_metric('avalon_engine_wakeups_total', 'counter', 'Times an engine thread woke up for a change.',
+                           [({}, metrics.get('engine_wakeups'))])
+    lines += format_metric('avalon_actions_total', 'counter', 'Actions processed, by players and computer players.',
+                           [({}, metrics.get('actions'))])
+    lines += format_metric('avalon_log_queue_depth', 'gauge', 'Event log records waiting to be written.',
+                           [({}, sum(a.event_log.queue.qsize() for a in games if a.event_log is not None))])
+    lines += format_metric('avalon_timer_threads', 'gauge', 'Live speaker timer threads.',
+                           [({}, sum(1 for t in threading.enumerate() if t.name.startswith('timer-')))])
+    lines += format_summary('avalon_ui_callback_seconds', 'Time spent in UI callbacks.', ui_histograms, 'callback')
+    lines += format_summary('avalon_engine_step_seconds', 'Time spent in each engine step.', engine_histograms, 'step')
+    return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(manager, host='127.0.0.1', port=9464):
+    """
+    To serve render_metrics(manager) at http://host:port/metrics from a daemon thread, for a Prometheus scraper.
+    Return the HTTP server.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_metrics(manager).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes every few seconds would flood the console
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
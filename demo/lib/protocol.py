@@ -0,0 +1,53 @@
+"""
+Framed protocol between the socket server (server.py) and the terminal client (client.py).
+
+Every message is a JSON object, sent as a frame: the length of the UTF-8 encoded JSON as a 4 bytes big-endian unsigned
+integer, followed by the JSON itself. Unlike raw recv(1024) calls, a frame is always read whole, however TCP splits or
+merges it, and messages could contain any character.
+
+Client to server:
+{'type': 'join', 'room': 'r1', 'nickname': 'ann'}                 # the first player in a room is its admin
+{'type': 'create', 'settings': {'has_percival': True}, 'n_ai': 2}  # admin only, start a game with the players so far
+{'type': 'input', 'input': '0 2 3'}                                # answer to a game message, or a '?' help request
+
+Server to client:
+{'type': 'info', 'msg': '...'}                  # room news, e.g. someone joined
+{'type': 'game', 'msg': '...', 'input': True}   # game message, 'input' is True if the game waits for an answer
+{'type': 'error', 'msg': '...'}
+"""
+import json
+import struct
+
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 1 << 20
+
+
+class ProtocolError(Exception):
+    """
+    A frame that is not a message, e.g. it is larger than MAX_FRAME_SIZE or its data is not a JSON object. The stream
+    could not be read any further after it, so the connection should be closed.
+    """
+
+
+def encode_frame(message):
+    data = json.dumps(message).encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+
+async def read_frame(reader):
+    """
+    To read one message from an asyncio StreamReader.
+    Raise asyncio.IncompleteReadError if the connection is closed, or ProtocolError if the frame is not a message.
+    """
+    header = await reader.readexactly(HEADER.size)
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f'Frame of {size} bytes is larger than the limit {MAX_FRAME_SIZE}!')
+    data = await reader.readexactly(size)
+    try:
+        message = json.loads(data.decode('utf-8'))
+    except ValueError as e:  # both UnicodeDecodeError and JSONDecodeError
+        raise ProtocolError(f'Frame is not valid JSON: {e}') from None
+    if not isinstance(message, dict):
+        raise ProtocolError('Frame is not a JSON object!')
+    return message
@@ -0,0 +1,184 @@
+"""
+Caches and incremental renderers of the game info, players info and game records of a game.
+
+Renders are keyed by what is rendered and for whom, e.g. ('players_info', nickname), and stamped with the state they
+were rendered from, e.g. the version of the knowledge matrix. A cached render is only returned while its stamp still
+matches, so a change of the relevant state invalidates it without anyone having to clear the cache, while changes that
+don't affect it (votes, speakers...) keep it valid. The least recently used renders are evicted once there are more than
+maxsize of them, so viewers coming and going could not grow the cache without bound.
+
+The game records only grow by one row per round, RecordsRenderer keeps the rows rendered for each viewer and only
+renders the new ones from the game history (see lib.history).
+"""
+from collections import OrderedDict
+import html
+import threading
+from prettytable import PrettyTable
+
+
+def display_user_label(nickname, target):
+    if target == nickname:
+        return target + '(You)'
+    return target
+
+
+class RenderCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp, render):
+        """
+        To return the cached render of key if it was rendered with the same stamp, otherwise call render() and cache
+        its result with the stamp.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # render outside of the lock, renders of other keys should not wait for it
+        value = render()
+        with self.lock:
+            self.entries[key] = (stamp, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RecordsView:
+    """
+    The game records as seen by one viewer, the rows are rendered once and then only appended to.
+    """
+    def __init__(self, field_names):
+        self.field_names = field_names
+        self.rows = []
+        self.table = PrettyTable()
+        self.table.field_names = field_names
+        self.html_rows = []
+
+    def add_row(self, row):
+        self.rows.append(row)
+        self.table.add_row(row)
+        self.html_rows.append('<tr>' + ''.join(f'<td>{html.escape(str(v))}</td>' for v in row) + '</tr>\n')
+
+
+class RecordsRenderer:
+    """
+    Incremental renderer of the game records of a game (Avalon.history), one RecordsView per viewer and revealed
+    flag. Avalon.record_game_history() calls append() after each new round is recorded, which renders one row for
+    every view, so rows rendered before are never rendered again. A view is only created when someone asks for it, and
+    then renders the records so far once. The least recently used views are dropped once there are more than maxsize
+    of them.
+    """
+    def __init__(self, avalon, maxsize=64):
+        self.avalon = avalon
+        self.maxsize = maxsize
+        self.n_rows = 0  # n of rounds of the history in the views
+        self.views = OrderedDict()
+        self.lock = threading.Lock()
+
+    def append(self):
+        with self.lock:
+            history = self.avalon.history
+            for i in range(self.n_rows, len(history)):
+                record = history.get_record(i)
+                for (nickname, revealed), view in self.views.items():
+                    view.add_row(self.render_row(nickname, revealed, record))
+            self.n_rows = len(history)
+
+    def get_view(self, nickname, revealed=False):
+        with self.lock:
+            key = (nickname, revealed)
+            view = self.views.get(key)
+            if view is None:
+                view = self.views[key] = RecordsView(self.get_field_names(nickname, revealed))
+                for i in range(self.n_rows):
+                    view.add_row(self.render_row(nickname, revealed, self.avalon.history.get_record(i)))
+                while len(self.views) > self.maxsize:
+                    self.views.popitem(last=False)
+            self.views.move_to_end(key)
+            return view
+
+    def render(self, nickname, revealed=False, output='text'):
+        """
+        To render the records as a pretty table if output is 'text', or as an HTML table if output is 'html'.
+        """
+        view = self.get_view(nickname, revealed)
+        with self.lock:
+            if output == 'text':
+                return str(view.table)
+            elif output == 'html':
+                header = ''.join(f'<th>{html.escape(str(n))}</th>' for n in view.field_names)
+                return (f'<table>\n<thead>\n<tr>{header}</tr>\n</thead>\n'
+                        f"<tbody>\n{''.join(view.html_rows)}</tbody>\n</table>")
+        raise Exception(f"Unknown output {output}, should be 'text' or 'html'!")
+
+    def get_rows(self, nickname, revealed=False, start=0):
+        """
+        To get the rows from the start-th one as {field name: value} dicts, e.g. to stream the new rows to a
+        Tabulator widget.
+        """
+        view = self.get_view(nickname, revealed)
+        with self.lock:
+            return [dict(zip(view.field_names, row)) for row in view.rows[start:]]
+
+    def get_field_names(self, nickname, revealed=False):
+        avalon = self.avalon
+        field_names = ['Q', 'R', 'L', 'M']
+        if avalon.has_lake_lady:
+            field_names += ['LL', 'T']
+
+        nicknames = [display_user_label(nickname, n) for n in avalon.nicknames]
+        if revealed:
+            nickname_with_star = [n + '*' if n in avalon.game_param.p_evil else n for n in avalon.nicknames]
+            field_names += sorted(nickname_with_star)
+        else:
+            field_names += sorted(nicknames)
+
+        field_names += ['N_A', 'VR', 'N_F', 'QR']
+        return field_names
+
+    def render_row(self, nickname, revealed, record):
+        avalon = self.avalon
+        row = [record['quest'], record['round'], display_user_label(nickname, record['leader'])]
+        if record['round'] > 1:
+            row = ['', record['round'], record['leader']]
+        if revealed:
+            members_with_star = [display_user_label(nickname, n) + '*'
+                                 if n in avalon.game_param.p_evil else display_user_label(nickname, n)
+                                 for n in record['members']]
+            row.append(', '.join(members_with_star))
+        else:
+            row.append(', '.join([display_user_label(nickname, n) for n in record['members']]))
+
+        if avalon.has_lake_lady:
+            row += [record['lake_lady'], record['lake_lady_target']]
+        if record['votes'] == {}:
+            row_vote = ['-'] * avalon.n_players
+        else:
+            row_vote = ['o' if record['votes'][n] == 'approve' else 'x' for n in sorted(record['votes'].keys())]
+        row += row_vote + [record['n_approve'], record['vote_result']]
+        if record['quest_result'] is not None:
+            if revealed:
+                members = [k for k, v in record['attempts'].items() if v == 'fail']
+                row += [', '.join(members), record['quest_result']]
+            else:
+                row += [record['n_fail'], record['quest_result']]
+        else:
+            row += ['N/A', 'N/A']
+        return row
@@ -0,0 +1,239 @@
+"""
+Manage multiple Avalon games (rooms) in one server process.
+
+Each room keeps its own players, admin, game and the temporary selections made in the UI (members, targets, timer), so
+one Panel server could host many tables at the same time. Rooms are keyed by a room id, which is synced to the URL
+next to the nickname.
+
+Each room runs its game as an actor: a single thread owns the game, and the player actions from all browser sessions
+are queued to it as commands (see Room.submit()) and applied in order, so sessions never change the game at the same
+time. Games are rebuilt from their event logs when the server restarts, see RoomManager.recover_rooms().
+"""
+from concurrent.futures import Future
+import glob
+import os
+import queue
+import threading
+import time
+import uuid
+from lib.event_log import EventLog, read_log
+from lib.game import Avalon
+from lib.metrics import ServerMetrics
+
+
+class Room:
+    def __init__(self, room_id, metrics=None):
+        self.room_id = room_id
+        self.metrics = metrics  # ServerMetrics shared by all rooms, or None
+        self.nicknames = []  # players that have joined the room, first one is the admin
+        self.admin = None
+        self.avalon = None  # the current game, None while players are waiting in the room
+        self.members = []  # members selected by the leader but not proposed yet
+        self.assassin_target = None  # target selected by the assassin but not confirmed yet
+        self.lake_lady_target = None  # target selected by the lady of the lake but not confirmed yet
+        self.timer = 20  # seconds left for the current speaker
+        self.actor = None  # thread running self.run_actor(), the only one that changes the game
+        self.commands = None  # queue of (game, action, args, future) waiting for the actor of the current game
+        self.batch_size = 32  # max n of commands applied before an engine pass
+        self.sessions = set()  # ids of the browser sessions in the room
+
+    def join(self, nickname):
+        """
+        To add a player to the room. The first player joined would be the admin of the room.
+        """
+        if not self.nicknames:
+            self.admin = nickname
+        self.nicknames.append(nickname)
+
+    def start_game(self, **settings):
+        """
+        To start a new game with all players in the room, settings are passed to Avalon as they are.
+        A thread is started to run the game until it ends or is closed, see self.run_actor().
+        """
+        if self.metrics is not None:
+            settings['instrument'] = self.metrics.latency
+        avalon = Avalon(self.nicknames.copy(), platform='api', **settings)
+        # the room id is logged so the game could be brought back to this room, see RoomManager.recover_rooms()
+        avalon.log_event('room', room_id=self.room_id)
+        self.run_game(avalon)
+        return avalon
+
+    def resume_game(self, avalon):
+        """
+        To put a game recovered from its event log back in the room, with the players of that game.
+        """
+        self.nicknames = list(avalon.human_nicknames)
+        self.admin = self.nicknames[0]
+        if self.metrics is not None:
+            avalon.instrument(self.metrics.latency)
+        self.run_game(avalon)
+
+    def run_game(self, avalon):
+        # every game gets its own queue, so the actor of a closed game could not take the commands of the next one
+        self.commands = queue.Queue()
+        self.avalon = avalon
+        self.members = []
+        self.assassin_target = None
+        self.lake_lady_target = None
+        self.timer = 20
+        self.actor = threading.Thread(target=self.run_actor,
+                                      args=(avalon, self.commands),
+                                      name=f'room-{self.room_id}',
+                                      daemon=True)
+        self.actor.start()
+
+    def close_game(self):
+        """
+        To close the current game and bring players back to the waiting page. The engine thread would notice it
+        within a second and stop.
+        """
+        self.avalon = None
+
+    def submit(self, action, *args):
+        """
+        To queue a player action for the game, e.g. submit('vote_quest', nickname, 'approve'). action is one of the
+        action methods of Avalon (see Avalon.replay_actions).
+        Return a Future of what the action method returns, e.g. 'ann voted approve.', which is set once the actor has
+        applied it. The action fails if the game is closed before that.
+        """
+        future = Future()
+        if action not in Avalon.replay_actions:
+            future.set_exception(Exception(f'Unknown action {action}!'))
+        elif self.avalon is None:
+            future.set_exception(Exception(f'No game is running in room {self.room_id}!'))
+        else:
+            self.commands.put((self.avalon, action, args, future))
+        return future
+
+    def run_actor(self, avalon, commands):
+        """
+        To apply the queued actions to the game in order and run the engine after them, until the game ends or is
+        closed. Actions queued at the same time (e.g. everyone voting at once) are applied together, up to
+        self.batch_size, before one engine pass.
+        """
+        n_actions = avalon.n_actions
+        while True:
+            batch = []
+            try:
+                # sleep until a player acts, the timeout is only to notice the game has been closed
+                batch.append(commands.get(timeout=1))
+                while len(batch) < self.batch_size:
+                    batch.append(commands.get_nowait())
+            except queue.Empty:
+                pass
+            for game, action, args, future in batch:
+                if game is not avalon or self.avalon is not avalon:
+                    future.set_exception(Exception('The game has been closed!'))
+                    continue
+                try:
+                    future.set_result(getattr(avalon, action)(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            avalon.api_server_run()
+            if self.metrics is not None:
+                if batch:
+                    self.metrics.inc('engine_wakeups')
+                self.metrics.inc('actions', avalon.n_actions - n_actions)
+                n_actions = avalon.n_actions
+            if avalon.end_game or self.avalon is not avalon:
+                avalon.close_log()
+                # fail whatever is still queued for this game, nobody would apply it
+                while True:
+                    try:
+                        _, _, _, future = commands.get_nowait()
+                    except queue.Empty:
+                        break
+                    future.set_exception(Exception('The game has been closed!'))
+                return
+
+
+class RoomManager:
+    def __init__(self, metrics=None):
+        self.rooms = {}
+        self.lock = threading.Lock()
+        self.metrics = metrics if metrics is not None else ServerMetrics()
+
+    def create_room(self, room_id=None):
+        """
+        To create a new room. If room_id is not given, a short random id is generated.
+        """
+        with self.lock:
+            if room_id is None:
+                room_id = uuid.uuid4().hex[:6]
+                while room_id in self.rooms:
+                    room_id = uuid.uuid4().hex[:6]
+            if room_id in self.rooms:
+                raise Exception(f'Room {room_id} already exists!')
+            room = Room(room_id, self.metrics)
+            self.rooms[room_id] = room
+            return room
+
+    def get_room(self, room_id):
+        """
+        To look up a room by its id. Return None if there is no such room.
+        """
+        return self.rooms.get(room_id)
+
+    def get_or_create_room(self, room_id):
+        with self.lock:
+            if room_id not in self.rooms:
+                self.rooms[room_id] = Room(room_id, self.metrics)
+            return self.rooms[room_id]
+
+    def remove_room(self, room_id):
+        """
+        To tear down a room, the game in the room (if any) is closed as well.
+        """
+        with self.lock:
+            room = self.rooms.pop(room_id, None)
+        if room is not None:
+            room.close_game()
+        return room
+
+    def list_rooms(self):
+        return list(self.rooms.values())
+
+    def recover_rooms(self, log_dir='log', time_budget=10):
+        """
+        To bring back the games that were still running when the server stopped, by replaying their event logs
+        (see Avalon.recover()).
+
+        Games that have been closed, or were not started in a room, are skipped. The latest game goes first and only
+        one game is recovered per room, the older games of the room are closed with a 'close' record, so they are not
+        read again on the next start. Once time_budget (in seconds) is used up, the rest are left as they are so the
+        server could start in time. Return the recovered rooms.
+        """
+        deadline = time.monotonic() + time_budget
+        paths = sorted(glob.glob(os.path.join(log_dir, '*.jsonl')), key=os.path.getmtime, reverse=True)
+        recovered = []
+        for path in paths:
+            if time.monotonic() > deadline:
+                print(f'Time budget used up, {len(recovered)} rooms recovered.')
+                break
+            room_id = None
+            closed = False
+            revision = 0
+            for record in read_log(path):
+                revision = record['revision']
+                if record['event'] == 'room':
+                    room_id = record['room_id']
+                elif record['event'] == 'close':
+                    closed = True
+            if closed or room_id is None:
+                continue
+            if any(room.room_id == room_id for room in recovered):
+                event_log = EventLog(path)
+                event_log.write({'event': 'close', 'revision': revision, 'reason': 'superseded'})
+                event_log.close()
+                continue
+            if room_id in self.rooms:
+                continue
+            try:
+                avalon = Avalon.recover(path)
+            except Exception as e:
+                print(f'Failed to recover {path}: {e}')
+                continue
+            room = self.get_or_create_room(room_id)
+            room.resume_game(avalon)
+            recovered.append(room)
+        return recovered
@@ -0,0 +1,156 @@
+"""
+Headless batch simulator of whole Avalon games, for win-rate statistics of the house rules.
+
+Instead of playing one game at a time through Avalon and its message packs, BatchSimulator plays a batch of games at
+once: role assignment, leader's proposals, votes and quest attempts are all drawn for the whole batch with NumPy, and
+the outcomes are returned as a structured array with one row per game. The rules (number of good/evil players, the
+characters, members of each quest and the 2 fail cards quest) come from Avalon itself.
+
+Players act at random like the computer players of Avalon: the leader picks random members, everyone approves with
+probability p_approve, good players always succeed the quest while evil players fail it with probability p_fail, and
+the assassin picks a random good player. Lady of the lake only changes what players know, which random players don't
+make use of, so it doesn't change the outcomes.
+
+Note that the 4th quest of games with 7 or more players needs 2 fail cards to fail, see Avalon.get_n_fail_needed().
+"""
+import numpy as np
+from lib.game import Avalon
+
+N_QUESTS = 5
+N_ROUNDS = 5
+SUCCESS = 1
+FAIL = -1
+
+
+class BatchSimulator:
+    def __init__(self,
+                 n_players=5,
+                 has_percival=False,
+                 has_morgana=False,
+                 has_mordred=False,
+                 has_oberon=False,
+                 has_lake_lady=False,
+                 p_approve=0.5,
+                 p_fail=1.0,
+                 batch_size=100000):
+        # Borrow the rules from a game without event log, it also validates the settings
+        avalon = Avalon([f'p{i}' for i in range(n_players)],
+                        has_percival=has_percival,
+                        has_morgana=has_morgana,
+                        has_mordred=has_mordred,
+                        has_oberon=has_oberon,
+                        has_lake_lady=has_lake_lady,
+                        platform='api',
+                        log_dir=None)
+        self.n_players = n_players
+        self.settings = dict(has_percival=has_percival,
+                             has_morgana=has_morgana,
+                             has_mordred=has_mordred,
+                             has_oberon=has_oberon,
+                             has_lake_lady=has_lake_lady)
+        # avalon.characters is shuffled for the players, take the characters in a fixed order instead
+        self.characters = avalon.good_characters + avalon.evil_characters
+        self.quests = np.array(avalon.quests)
+        # n of fail cards to fail each quest, the same as in Avalon.get_quest_result()
+        self.fails_needed = np.array([avalon.get_n_fail_needed(q) for q in range(1, N_QUESTS + 1)], dtype=np.int8)
+        self.is_evil_character = np.array([c in avalon.evil_characters for c in self.characters])
+        self.merlin = self.characters.index('merlin')
+        self.p_approve = p_approve
+        self.p_fail = p_fail
+        self.batch_size = batch_size
+        self.dtype = np.dtype([('good_win', np.bool_),
+                               ('assassin_success', np.bool_),
+                               ('n_quests', np.int8),
+                               ('quest_results', np.int8, (N_QUESTS,)),
+                               ('n_fail', np.int8, (N_QUESTS,)),
+                               ('n_rounds', np.int8, (N_QUESTS,)),
+                               ('characters', np.int8, (n_players,))])
+
+    def run(self, n_games, seed=None):
+        """
+        To simulate n_games games and return a structured array with one row per game:
+
+        'good_win': if good side won the game
+        'assassin_success': if the assassin killed merlin after good side won 3 quests
+        'n_quests': n of quests played
+        'quest_results': SUCCESS/FAIL of each quest, 0 if the quest wasn't played
+        'n_fail': n of fail cards of each quest
+        'n_rounds': n of proposals made for each quest, the 5th proposal is approved without vote
+        'characters': the character of each seat, as an index of self.characters
+
+        Games are simulated in batches of self.batch_size, so millions of games don't need millions of rows in memory
+        at the same time for the intermediate arrays.
+        """
+        rng = np.random.default_rng(seed)
+        results = np.zeros(n_games, dtype=self.dtype)
+        for start in range(0, n_games, self.batch_size):
+            stop = min(start + self.batch_size, n_games)
+            self.run_batch(rng, results[start:stop])
+        return results
+
+    def run_batch(self, rng, results):
+        n_games = len(results)
+        n = self.n_players
+        games = np.arange(n_games)
+
+        # Deal the characters, a random permutation of the character list for each game
+        characters = rng.random((n_games, n)).argsort(axis=1).astype(np.int8)
+        results['characters'] = characters
+        is_evil = self.is_evil_character[characters]
+
+        n_success = np.zeros(n_games, dtype=np.int8)
+        n_failed = np.zeros(n_games, dtype=np.int8)
+        ongoing = np.ones(n_games, dtype=np.bool_)
+
+        for quest in range(N_QUESTS):
+            n_members = self.quests[quest]
+            playing = ongoing
+
+            # Everyone votes regardless of the members, so only the approved proposal needs to be drawn. A proposal is
+            # approved by the majority, or without vote in the 5th round.
+            n_approve = rng.binomial(n, self.p_approve, size=(n_games, N_ROUNDS - 1))
+            approved = np.concatenate([n_approve > n // 2, np.ones((n_games, 1), dtype=np.bool_)], axis=1)
+            n_rounds = (approved.argmax(axis=1) + 1).astype(np.int8)
+            picks = np.argpartition(rng.random((n_games, n)), n_members, axis=1)[:, :n_members]
+            members = np.zeros((n_games, n), dtype=np.bool_)
+            members[games[:, None], picks] = True
+
+            # good players always succeed, evil players fail with probability p_fail
+            fails = members & is_evil & (rng.random((n_games, n)) < self.p_fail)
+            n_fail = fails.sum(axis=1).astype(np.int8)
+            failed = n_fail >= self.fails_needed[quest]
+
+            results['n_rounds'][playing, quest] = n_rounds[playing]
+            results['n_fail'][playing, quest] = n_fail[playing]
+            results['quest_results'][playing, quest] = np.where(failed, FAIL, SUCCESS)[playing]
+            results['n_quests'] += playing
+            n_success += playing & ~failed
+            n_failed += playing & failed
+            ongoing = ongoing & (n_success < 3) & (n_failed < 3)
+
+        # Good side won 3 quests, the assassin still could kill merlin, picking one of the good players at random
+        good_seats = ~is_evil
+        pick = rng.random((n_games, n)) * good_seats
+        target = pick.argmax(axis=1)
+        assassin_success = (n_success >= 3) & (characters[games, target] == self.merlin)
+        results['assassin_success'] = assassin_success
+        results['good_win'] = (n_success >= 3) & ~assassin_success
+
+    def summarize(self, results):
+        """
+        To calculate the win rates and a few other statistics from the results of self.run().
+        """
+        n_games = len(results)
+        good_3_quests = (results['quest_results'] == SUCCESS).sum(axis=1) >= 3
+        return {
+            'n_players': self.n_players,
+            **self.settings,
+            'p_approve': self.p_approve,
+            'p_fail': self.p_fail,
+            'n_games': n_games,
+            'good_win_rate': float(results['good_win'].mean()) if n_games else 0.0,
+            'evil_win_by_quests_rate': float((~good_3_quests).mean()) if n_games else 0.0,
+            'evil_win_by_assassin_rate': float(results['assassin_success'].mean()) if n_games else 0.0,
+            'mean_quests': float(results['n_quests'].mean()) if n_games else 0.0,
+            'mean_rounds': float(results['n_rounds'].sum(axis=1).mean()) if n_games else 0.0
+        }
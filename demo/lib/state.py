@@ -0,0 +1,358 @@
+"""
+Typed game state for Avalon.
+
+GameState replaces the plain 'game_param' dict. Every known parameter is a slot, so the engine reads and writes them as
+attributes (self.game_param.leader) instead of looking up string keys. GameState still behaves as a mapping
+(game_param['leader']), so the message templates, the help messages and the Panel UI keep working without change.
+
+Stages are Stage members, which are also plain strings ('vote' == Stage.VOTE), and player pools such as 'p_no_vote'
+are Pool objects with O(1) membership and removal that keep the order of the players.
+"""
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Mapping, MutableMapping
+from enum import Enum
+from operator import attrgetter
+
+
+class Stage(str, Enum):
+    INIT = 'init'
+    LAKE_LADY = 'lake_lady'
+    SPEAK = 'speak'
+    PROPOSAL = 'proposal'
+    VOTE = 'vote'
+    QUEST = 'quest'
+    RECORD = 'record'
+    END = 'end'
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+class Pool:
+    """
+    An ordered set of nicknames, e.g. players who haven't voted yet.
+    Membership test and removal are O(1), while it still supports what the game needs from a list: iteration in
+    order, indexing for the options list, copy(), pop() and concatenation with a list.
+    """
+    __slots__ = ('items',)
+
+    def __init__(self, nicknames=()):
+        self.items = dict.fromkeys(nicknames)
+
+    def __contains__(self, nickname):
+        return nickname in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return list(self.items)[index]
+
+    def __add__(self, other):
+        return list(self.items) + list(other)
+
+    def __eq__(self, other):
+        if isinstance(other, (Pool, list, tuple)):
+            return list(self.items) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self.items))
+
+    def append(self, nickname):
+        self.items[nickname] = None
+
+    def remove(self, nickname):
+        if nickname not in self.items:
+            raise ValueError(f'{nickname} is not in the pool')
+        del self.items[nickname]
+
+    def pop(self, index=-1):
+        nickname = self[index]
+        del self.items[nickname]
+        return nickname
+
+    def copy(self):
+        return Pool(self.items)
+
+
+class SeatRing:
+    """
+    The seats of a game in playing order, with the next seat of every player and the order of the human players
+    starting from every seat worked out once, so passing the leadership around and queueing the speakers of a new round
+    don't search or slice the seat list.
+    """
+    __slots__ = ('p_positions', 'next_seats', 'human_orders')
+
+    def __init__(self, p_positions, human_nicknames):
+        self.p_positions = tuple(p_positions)
+        n = len(self.p_positions)
+        self.next_seats = dict((p, self.p_positions[(i + 1) % n]) for i, p in enumerate(self.p_positions))
+        # the human players in playing order, starting from each seat (the seat itself included if human)
+        seats = [i for i, p in enumerate(self.p_positions) if p in human_nicknames]
+        humans = tuple(self.p_positions[i] for i in seats)
+        self.human_orders = {}
+        for i, p in enumerate(self.p_positions):
+            k = bisect_left(seats, i)
+            self.human_orders[p] = humans[k:] + humans[:k]
+
+    def next(self, nickname):
+        """
+        To get the player sitting after the player, the first player comes after the last one.
+        """
+        return self.next_seats[nickname]
+
+    def get_speakers(self, nickname):
+        """
+        To get the queue of human speakers of a round led by the player, in playing order from the leader.
+        """
+        return deque(self.human_orders[nickname])
+
+
+class Tally:
+    """
+    Running counts of the votes and attempts of the current round and of the quest results so far. They are updated
+    by the actions as they happen, so checking if everyone has voted or who has won 3 quests never counts anything.
+    """
+    __slots__ = ('n_votes', 'n_approve', 'n_attempts', 'n_fail', 'n_success_quests', 'n_fail_quests')
+
+    def __init__(self):
+        self.n_success_quests = 0
+        self.n_fail_quests = 0
+        self.new_round()
+
+    def new_round(self):
+        self.n_votes = 0
+        self.n_approve = 0
+        self.n_attempts = 0
+        self.n_fail = 0
+
+    def add_vote(self, vote, previous=None):
+        """
+        To count a vote, previous is the vote it replaces if the player has voted before.
+        """
+        if previous is None:
+            self.n_votes += 1
+        elif previous == 'approve':
+            self.n_approve -= 1
+        if vote == 'approve':
+            self.n_approve += 1
+
+    def add_attempt(self, attempt, previous=None):
+        """
+        To count an attempt, previous is the attempt it replaces if the player has attempted before.
+        """
+        if previous is None:
+            self.n_attempts += 1
+        elif previous == 'fail':
+            self.n_fail -= 1
+        if attempt == 'fail':
+            self.n_fail += 1
+
+    def add_quest_result(self, result):
+        if result == 'success':
+            self.n_success_quests += 1
+        else:
+            self.n_fail_quests += 1
+
+    def get_winner(self):
+        """
+        To get the side that has won 3 quests, or None.
+        """
+        if self.n_success_quests > 2:
+            return 'good'
+        if self.n_fail_quests > 2:
+            return 'evil'
+        return None
+
+
+class GameState(MutableMapping):
+    """
+    All the information of a game, for all players and also the server to determine the progress of the game.
+    See Avalon.init_game_param() for the meaning of each parameter.
+
+    Parameters that are not known in advance (e.g. the 'loyal servant' key) are kept in 'extras'. A slot that has not
+    been set is treated as a missing key, the same as it was in the dict.
+
+    Every parameter that is set or deleted is noted in 'changed', so the event log only has to look at those (see
+    pop_changed()). A value that is changed in place, e.g. votes[nickname] = vote, has to be noted with
+    mark_changed().
+    """
+    __slots__ = ('quest',
+                 'round',
+                 'stage',
+                 'n_members',
+                 'leader',
+                 'members',
+                 'done_proposal',
+                 'votes',
+                 'p_no_vote',
+                 'done_vote',
+                 'n_approve',
+                 'vote_result',
+                 'attempts',
+                 'p_no_attempt',
+                 'done_quest',
+                 'n_fail',
+                 'quest_result',
+                 'quest_results',
+                 'win_3_quests',
+                 'assassin_target',
+                 'assassin_success',
+                 'lake_lady',
+                 'lake_lady_target',
+                 'p_no_lake_lady',
+                 'done_lake_lady',
+                 'merlin',
+                 'percival',
+                 'assassin',
+                 'morgana',
+                 'mordred',
+                 'oberon',
+                 'sides',
+                 'p_good',
+                 'p_evil',
+                 'progress',
+                 'client_calls',
+                 'speaker',
+                 'p_no_speak',
+                 'done_speak',
+                 'new_round',
+                 'extras',
+                 'changed')
+
+    keys_ = __slots__[:-2]
+    key_set = frozenset(keys_)
+    pool_keys = frozenset(['p_no_vote', 'p_no_attempt', 'p_no_lake_lady', 'p_good', 'p_evil'])
+    # the 'done_*' indicator of each stage, 'end' stage is never done
+    stage_done = {
+        Stage.LAKE_LADY: attrgetter('done_lake_lady'),
+        Stage.SPEAK: attrgetter('done_speak'),
+        Stage.PROPOSAL: attrgetter('done_proposal'),
+        Stage.VOTE: attrgetter('done_vote'),
+        Stage.QUEST: attrgetter('done_quest')
+    }
+
+    def __init__(self, **params):
+        object.__setattr__(self, 'changed', set())
+        object.__setattr__(self, 'extras', {})
+        for key, value in params.items():
+            self[key] = value
+
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, value)
+        self.changed.add(key)
+
+    def __delattr__(self, key):
+        object.__delattr__(self, key)
+        self.changed.add(key)
+
+    def __getitem__(self, key):
+        if key in self.key_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return self.extras[key]
+
+    def __setitem__(self, key, value):
+        if key in self.key_set:
+            if key in self.pool_keys and not isinstance(value, Pool):
+                value = Pool(value)
+            elif key == 'stage':
+                value = Stage(value)
+            setattr(self, key, value)
+        else:
+            self.extras[key] = value
+            self.changed.add(key)
+
+    def __delitem__(self, key):
+        if key in self.key_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        else:
+            del self.extras[key]
+            self.changed.add(key)
+
+    def __contains__(self, key):
+        if key in self.key_set:
+            return hasattr(self, key)
+        return key in self.extras
+
+    def __iter__(self):
+        for key in self.keys_:
+            if hasattr(self, key):
+                yield key
+        yield from self.extras
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def is_stage_done(self):
+        """
+        To check the 'done_*' indicator of the current stage, e.g. 'done_vote' for 'vote' stage.
+        """
+        get_done = self.stage_done.get(self.stage)
+        return bool(get_done and get_done(self))
+
+    def mark_changed(self, *keys):
+        """
+        To note parameters that have been changed in place, e.g. a player removed from 'p_no_vote'.
+        """
+        self.changed.update(keys)
+
+    def pop_changed(self):
+        """
+        To get the keys of the parameters that have been set, deleted or marked as changed since the last call.
+        """
+        changed = self.changed
+        object.__setattr__(self, 'changed', set())
+        return changed
+
+    def as_dict(self):
+        """
+        To convert the state to a plain dict, e.g. for pprint or logging. Pools are converted to lists.
+        """
+        return dict((k, list(v) if isinstance(v, Pool) else v) for k, v in self.items())
+
+    def view(self):
+        return GameStateView(self)
+
+
+class GameStateView(Mapping):
+    """
+    A read-only mapping view of a GameState, for the UI and any other observer that should not change the game.
+    """
+    __slots__ = ('state',)
+
+    def __init__(self, state):
+        self.state = state
+
+    def __getitem__(self, key):
+        return self.state[key]
+
+    def __contains__(self, key):
+        return key in self.state
+
+    def __iter__(self):
+        return iter(self.state)
+
+    def __len__(self):
+        return len(self.state)
+
+    def __repr__(self):
+        return repr(self.state)
@@ -0,0 +1,35 @@
+"""
+Read the event log of a game (log/<game_id>.jsonl).
+
+eg:
+python read_log.py log/20230413-201500-a1b2c3.jsonl                 # print the last state of the game
+python read_log.py log/20230413-201500-a1b2c3.jsonl --revision 42   # print the state at revision 42
+python read_log.py log/20230413-201500-a1b2c3.jsonl --actions       # print all actions of players
+"""
+import argparse
+import pprint
+from lib.event_log import read_log, rebuild_state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the state of an Avalon game from its event log.')
+    parser.add_argument('path', help='path of the event log')
+    parser.add_argument('--revision', type=int, default=None, help='revision to rebuild, default is the last one')
+    parser.add_argument('--actions', action='store_true', help='print the actions instead of the state')
+    args = parser.parse_args()
+
+    if args.actions:
+        for record in read_log(args.path):
+            if record['event'] == 'action':
+                data = dict((k, v) for k, v in record.items() if k not in ['event', 'revision', 't', 'action'])
+                print(record['revision'], record['action'], data)
+    else:
+        state = rebuild_state(args.path, args.revision)
+        if state is None:
+            print('No state is logged at or before this revision.')
+        else:
+            pprint.pprint(state)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Asyncio socket server for playing Avalon ('socket' platform) from a terminal, see client.py.
+
+All rooms run on one event loop. Each room owns its game and an asyncio.Lock, every access to the game goes through
+the lock, and the room task is the only one that moves the game forward: it runs client_run() for the players who are
+ready and server_step() until nothing changes, then sleeps until a player sends something.
+
+Messages are framed (see lib.protocol). Every client has a bounded queue of outgoing frames that a writer task
+drains, so a broadcast never waits for a slow client. A client whose queue is full is disconnected instead, and could
+join the room again with the same nickname to pick up the game where it left.
+
+eg:
+python server.py                          # listen on 127.0.0.1:1235
+python server.py --host 0.0.0.0 --port 1235 --log-dir log
+"""
+import argparse
+import asyncio
+from lib.game import Avalon
+from lib.protocol import ProtocolError, encode_frame, read_frame
+from lib.state import Stage
+
+SETTINGS = ['has_percival', 'has_morgana', 'has_mordred', 'has_oberon', 'has_lake_lady']
+
+
+class Connection:
+    def __init__(self, writer, queue_size=256):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self.writer_task = asyncio.create_task(self.write_frames())
+
+    def send(self, message):
+        """
+        To queue a message without waiting. Return False if the client is too slow and has been disconnected.
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(encode_frame(message))
+        except asyncio.QueueFull:
+            self.close()
+            return False
+        return True
+
+    async def write_frames(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                self.writer.write(frame)
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer_task.cancel()
+        self.writer.close()
+
+
+class SocketRoom:
+    def __init__(self, room_id, log_dir='log'):
+        self.room_id = room_id
+        self.log_dir = log_dir
+        self.lock = asyncio.Lock()
+        self.changed = asyncio.Event()
+        self.nicknames = []
+        self.admin = None
+        self.connections = {}
+        self.avalon = None
+        self.game_task = None
+        self.inputs = {}  # the latest input of each player, waiting for the game to ask for it
+        self.last_msgs = {}  # the last game message sent to each player
+
+    def broadcast(self, message):
+        for nickname, connection in list(self.connections.items()):
+            if not connection.send(message):
+                del self.connections[nickname]
+
+    def send(self, nickname, message):
+        connection = self.connections.get(nickname)
+        if connection is not None and not connection.send(message):
+            del self.connections[nickname]
+
+    async def join(self, nickname, connection):
+        async with self.lock:
+            if nickname in self.connections:
+                raise Exception(f'{nickname} is already in room {self.room_id}!')
+            if self.avalon is not None and nickname not in self.avalon.human_nicknames:
+                raise Exception(f'The game in room {self.room_id} has started!')
+            if nickname not in self.nicknames:
+                self.nicknames.append(nickname)
+            if self.admin is None:
+                self.admin = nickname
+            self.connections[nickname] = connection
+            self.broadcast({'type': 'info', 'msg': f'{nickname} joined room {self.room_id}!'})
+            if nickname == self.admin:
+                self.send(nickname, {'type': 'info', 'msg': 'You are the admin!'})
+            # back to a game in progress, show the last message again
+            if self.avalon is not None and nickname in self.last_msgs:
+                self.send(nickname, {'type': 'game',
+                                     'msg': self.last_msgs[nickname],
+                                     'input': self.avalon.needs_input(nickname)})
+
+    async def leave(self, nickname, connection):
+        async with self.lock:
+            if self.connections.get(nickname) is connection:
+                del self.connections[nickname]
+            if self.avalon is None and nickname in self.nicknames:
+                self.nicknames.remove(nickname)
+                if self.admin == nickname:
+                    self.admin = self.nicknames[0] if self.nicknames else None
+            self.broadcast({'type': 'info', 'msg': f'{nickname} left!'})
+
+    async def create_game(self, nickname, settings, n_ai=0):
+        async with self.lock:
+            if nickname != self.admin:
+                raise Exception('Only the admin could create the game!')
+            if self.avalon is not None:
+                raise Exception('The game has started!')
+            self.avalon = Avalon(self.nicknames.copy(),
+                                 n_ai=n_ai,
+                                 platform='socket',
+                                 log_dir=self.log_dir,
+                                 **dict((k, bool(settings.get(k))) for k in SETTINGS))
+            self.inputs.clear()
+            self.last_msgs.clear()
+            self.broadcast({'type': 'info', 'msg': f"Game created with {', '.join(self.avalon.p_positions)}."})
+        self.game_task = asyncio.create_task(self.run_game())
+
+    async def handle_input(self, nickname, input_):
+        async with self.lock:
+            if self.avalon is None:
+                raise Exception('The game has not started yet!')
+            if input_.strip().startswith('?'):
+                self.send(nickname, {'type': 'game',
+                                     'msg': self.avalon.client_run(nickname, input_.strip()),
+                                     'input': self.avalon.needs_input(nickname)})
+                return
+            self.inputs[nickname] = input_
+        self.changed.set()
+
+    async def run_game(self):
+        """
+        To move the game forward whenever a player sends something, until the game ends.
+        """
+        while True:
+            async with self.lock:
+                self.pump()
+                if self.is_game_over():
+                    self.avalon.close_log()
+                    self.avalon = None
+                    self.nicknames = [n for n in self.nicknames if n in self.connections]
+                    if self.admin not in self.nicknames:
+                        self.admin = self.nicknames[0] if self.nicknames else None
+                    self.broadcast({'type': 'info', 'msg': 'Game over, the admin could create a new game.'})
+                    return
+            await self.changed.wait()
+            self.changed.clear()
+
+    def pump(self):
+        """
+        To run client_run() for the players and server_step() for the game until nothing changes.
+        """
+        while True:
+            changed = False
+            for nickname in self.avalon.human_nicknames:
+                changed = self.step_player(nickname) or changed
+            self.avalon.server_step()
+            if not changed and self.avalon.revision == self.avalon.handled_revision:
+                return
+
+    def step_player(self, nickname):
+        """
+        To run client_run() for a player, unless the game waits for his input and he hasn't sent it yet.
+        A message is sent to the player unless it repeats the last one, e.g. 'Please wait other players...'.
+        Return True if the player has moved on or got a message.
+        """
+        needs_input = self.avalon.needs_input(nickname)
+        if needs_input and nickname not in self.inputs:
+            return False
+        input_ = self.inputs.pop(nickname) if needs_input else None
+        progress = self.avalon.game_param.progress[nickname]
+        before = (progress['stage'], progress['step'])
+        msg = self.avalon.client_run(nickname, input_)
+        moved = (progress['stage'], progress['step']) != before
+        if msg is not None and (moved or input_ is not None or msg != self.last_msgs.get(nickname)):
+            self.last_msgs[nickname] = msg
+            self.send(nickname, {'type': 'game', 'msg': msg, 'input': self.avalon.needs_input(nickname)})
+            return True
+        return moved
+
+    def is_game_over(self):
+        if not self.avalon.end_game:
+            return False
+        last_step = len(self.avalon.msg_packs[Stage.END]) - 1
+        return all(v['stage'] == Stage.END and v['step'] == last_step for v in self.avalon.game_param.progress.values())
+
+
+class GameServer:
+    def __init__(self, log_dir='log', queue_size=256):
+        self.log_dir = log_dir
+        self.queue_size = queue_size
+        self.rooms = {}
+
+    async def handle_client(self, reader, writer):
+        connection = Connection(writer, self.queue_size)
+        room = None
+        nickname = None
+        try:
+            while not connection.closed:
+                message = await read_frame(reader)
+                try:
+                    if message.get('type') == 'join':
+                        if room is not None:
+                            raise Exception(f'You are already in room {room.room_id}!')
+                        nickname = str(message.get('nickname', '')).strip()
+                        room_id = str(message.get('room', '')).strip()
+                        if not nickname or not room_id:
+                            raise Exception('Both room and nickname are required to join!')
+                        if room_id not in self.rooms:
+                            self.rooms[room_id] = SocketRoom(room_id, self.log_dir)
+                        try:
+                            await self.rooms[room_id].join(nickname, connection)
+                        finally:
+                            self.close_room_if_empty(self.rooms[room_id])
+                        room = self.rooms[room_id]
+                    elif room is None:
+                        raise Exception('Please join a room first!')
+                    elif message.get('type') == 'create':
+                        await room.create_game(nickname, message.get('settings', {}), int(message.get('n_ai', 0)))
+                    elif message.get('type') == 'input':
+                        await room.handle_input(nickname, str(message.get('input', '')))
+                    else:
+                        raise Exception(f"Unknown message type {message.get('type')}!")
+                except Exception as e:
+                    connection.send({'type': 'error', 'msg': str(e)})
+        except ProtocolError as e:
+            # the rest of the stream could not be read, tell the client why before closing the connection
+            writer.write(encode_frame({'type': 'error', 'msg': str(e)}))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            connection.close()
+            if room is not None:
+                await room.leave(nickname, connection)
+                self.close_room_if_empty(room)
+
+    def close_room_if_empty(self, room):
+        if not room.connections and room.avalon is None and self.rooms.get(room.room_id) is room:
+            del self.rooms[room.room_id]
+
+    async def serve(self, host='127.0.0.1', port=1235):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve Avalon games to terminal clients.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=1235, help='port to listen on')
+    parser.add_argument('--log-dir', default='log', help='directory of the event logs of the games')
+    parser.add_argument('--queue-size', type=int, default=256,
+                        help='n of messages a client could fall behind before being disconnected')
+    args = parser.parse_args()
+    asyncio.run(GameServer(args.log_dir, args.queue_size).serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
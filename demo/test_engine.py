@@ -0,0 +1,34 @@
+"""
+Engine loop tests: which changes wake the engine up again after a pass.
+
+eg:
+python -m pytest -q test_engine.py
+"""
+import threading
+from lib.game import Avalon
+
+
+def test_change_from_another_thread_during_a_pass_is_not_lost():
+    avalon = Avalon([f'p{i}' for i in range(5)], platform='socket', log_dir=None, seed=0)
+    handle_proposal = avalon.handle_proposal
+
+    def handle_proposal_with_client():
+        # a client thread changes the game while the engine is in the middle of its pass
+        client = threading.Thread(target=avalon.notify_change)
+        client.start()
+        client.join()
+        handle_proposal()
+
+    avalon.handle_proposal = handle_proposal_with_client
+    avalon.game_param.stage = 'proposal'
+    avalon.notify_change()
+    avalon.server_step()
+    assert avalon.wait_for_change(timeout=0)
+
+
+def test_changes_of_the_engine_do_not_wake_it_up():
+    avalon = Avalon([f'p{i}' for i in range(5)], platform='socket', log_dir=None, seed=0)
+    avalon.game_param.stage = 'proposal'
+    avalon.notify_change()
+    avalon.server_step()
+    assert not avalon.wait_for_change(timeout=0)
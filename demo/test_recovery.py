@@ -0,0 +1,59 @@
+"""
+Recovery tests: a game is stopped at some point of a seeded 'api' game, recovered from its event log and played on with
+the same random players, it has to end exactly as the game that was never stopped.
+
+eg:
+python -m pytest -q test_recovery.py
+"""
+import json
+import random
+import pytest
+from benchmark import HUMANS, act
+from lib.game import Avalon
+
+
+def stop(avalon, mid_pass=False):
+    """
+    To stop the game without closing its log and recover it. With mid_pass, the last 'engine' record and everything
+    after it are dropped, as if the engine stopped after the computer players' actions but before the end of the pass.
+    """
+    avalon.event_log.close()
+    if mid_pass:
+        with open(avalon.event_log.path) as f:
+            lines = f.read().splitlines()
+        engine = [i for i, line in enumerate(lines) if json.loads(line)['event'] == 'engine']
+        if engine:
+            with open(avalon.event_log.path, 'w') as f:
+                f.write(''.join(line + '\n' for line in lines[:engine[-1]]))
+    return Avalon.recover(avalon.event_log.path)
+
+
+def play(seed, log_dir, stop_at=None, where='action'):
+    """
+    To play a whole game, stopping and recovering it after the action of step stop_at ('action'), after the engine
+    pass of that step ('engine'), or in the middle of that pass ('mid_pass'). Return the end state and the n of steps.
+    """
+    avalon = Avalon(HUMANS.copy(), n_ai=2 + seed % 6, has_lake_lady=seed % 2 == 1, has_percival=seed % 2 == 0,
+                    platform='api', log_dir=log_dir, seed=seed)
+    r = random.Random(seed)
+    for step in range(3000):
+        avalon.api_server_run()
+        if step == stop_at and where != 'action':
+            avalon = stop(avalon, mid_pass=where == 'mid_pass')
+            avalon.api_server_run()
+        if not act(avalon, r):
+            break
+        if step == stop_at and where == 'action':
+            avalon = stop(avalon)
+    avalon.close_log()
+    history = [avalon.history.get_record(i) for i in range(len(avalon.history))]
+    end = json.dumps([avalon.game_param.as_dict(), history, avalon.end_game], default=list, sort_keys=True)
+    return end, step
+
+
+@pytest.mark.parametrize('where', ['action', 'engine', 'mid_pass'])
+@pytest.mark.parametrize('seed', range(6))
+def test_recovered_game_ends_the_same(seed, where, tmp_path):
+    expected, n_steps = play(seed, tmp_path / 'full')
+    for stop_at in random.Random(seed).sample(range(n_steps), 5):
+        assert play(seed, tmp_path / f'{stop_at}', stop_at, where)[0] == expected, f'stopped at step {stop_at}'
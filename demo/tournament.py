@@ -0,0 +1,154 @@
+"""
+Run a Monte Carlo tournament of simulated games across all CPU cores, for balance studies of the house rules.
+
+Every configuration (n of players and the special characters) is split into chunks of games, and the chunks are run by
+lib.simulator.BatchSimulator in a pool of processes. Each chunk gets its own seed spawned from the tournament seed, so
+the results only depend on the seed and the chunk size, not on the n of workers or which worker runs which chunk.
+
+eg:
+python tournament.py --players 5 6 7 8 9 10 --games 1000000
+python tournament.py --players 7 --roles "" percival,morgana percival,morgana,mordred --games 5000000 --workers 64
+python tournament.py --players 5 --games 100000 --seed 42 --json result.json
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from prettytable import PrettyTable
+from lib.simulator import BatchSimulator
+
+ROLES = ['percival', 'morgana', 'mordred', 'oberon', 'lake_lady']
+COUNT_KEYS = ['n_games', 'good_wins', 'evil_wins', 'good_3_quests', 'assassin_hits', 'n_quests', 'n_rounds']
+
+# simulators already built in this worker process, keyed by configuration
+simulators = {}
+
+
+def get_simulator(config):
+    key = tuple(sorted(config.items()))
+    if key not in simulators:
+        simulators[key] = BatchSimulator(**config)
+    return simulators[key]
+
+
+def run_chunk(config, n_games, seed):
+    """
+    To simulate one chunk of games in a worker process and return the counts, which are small enough to send back to
+    the main process and could simply be added up.
+    """
+    results = get_simulator(config).run(n_games, seed=seed)
+    good_3_quests = results['assassin_success'] | results['good_win']
+    return {
+        'n_games': n_games,
+        'good_wins': int(results['good_win'].sum()),
+        'evil_wins': int(n_games - results['good_win'].sum()),
+        'good_3_quests': int(good_3_quests.sum()),
+        'assassin_hits': int(results['assassin_success'].sum()),
+        'n_quests': int(results['n_quests'].sum(dtype=np.int64)),
+        'n_rounds': int(results['n_rounds'].sum(dtype=np.int64))
+    }
+
+
+def get_configs(players, roles, p_approve, p_fail):
+    """
+    To list all configurations of the tournament. A configuration that is not allowed by the rules (e.g. too many
+    evil characters for 5 players) is skipped with a message.
+    """
+    configs = []
+    for n_players in players:
+        for role_set in roles:
+            names = [r for r in role_set.split(',') if r]
+            for name in names:
+                if name not in ROLES:
+                    raise Exception(f"Unknown role {name}, should be one of {', '.join(ROLES)}!")
+            config = dict(n_players=n_players, p_approve=p_approve, p_fail=p_fail)
+            config.update(dict((f'has_{r}', r in names) for r in ROLES))
+            try:
+                get_simulator(config)
+            except Exception as e:
+                print(f'Skip {n_players} players with {role_set or "no special roles"}: {e}')
+                continue
+            configs.append(config)
+    return configs
+
+
+def get_summary(config, counts):
+    n_games = counts['n_games']
+    return {
+        'n_players': config['n_players'],
+        'roles': ','.join(r for r in ROLES if config[f'has_{r}']),
+        'n_games': n_games,
+        'good_win_rate': counts['good_wins'] / n_games,
+        'evil_win_rate': counts['evil_wins'] / n_games,
+        'assassin_hit_rate': counts['assassin_hits'] / counts['good_3_quests'] if counts['good_3_quests'] else 0.0,
+        'mean_quests': counts['n_quests'] / n_games,
+        'mean_rounds': counts['n_rounds'] / n_games
+    }
+
+
+def run_tournament(configs, n_games, chunk_size=100000, workers=None, seed=0):
+    """
+    To run n_games games for every configuration in a pool of processes and merge the counts of all chunks.
+    Return a summary (win rates by side, assassin hit rate, average quests played...) for each configuration.
+    """
+    tasks = []
+    for i, config in enumerate(configs):
+        for start in range(0, n_games, chunk_size):
+            tasks.append((i, config, min(chunk_size, n_games - start)))
+    # one independent seed per chunk, the same for any n of workers
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+
+    totals = [dict((k, 0) for k in COUNT_KEYS) for _ in configs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(i, executor.submit(run_chunk, config, size, chunk_seed))
+                   for (i, config, size), chunk_seed in zip(tasks, seeds)]
+        for i, future in futures:
+            counts = future.result()
+            for k in COUNT_KEYS:
+                totals[i][k] += counts[k]
+
+    return [get_summary(config, counts) for config, counts in zip(configs, totals)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate Avalon games on all CPU cores and report the win rates.')
+    parser.add_argument('--players', type=int, nargs='+', default=[5, 6, 7, 8, 9, 10], help='n of players to test')
+    parser.add_argument('--roles', nargs='+', default=[''],
+                        help=f"comma separated special roles of each configuration, from {', '.join(ROLES)}")
+    parser.add_argument('--games', type=int, default=100000, help='n of games for each configuration')
+    parser.add_argument('--chunk', type=int, default=100000, help='n of games simulated by a worker at a time')
+    parser.add_argument('--workers', type=int, default=None, help='n of worker processes, default is all cores')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the tournament')
+    parser.add_argument('--p-approve', type=float, default=0.5, help='chance that a player approves a proposal')
+    parser.add_argument('--p-fail', type=float, default=1.0, help='chance that an evil player fails a quest')
+    parser.add_argument('--json', default=None, help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    configs = get_configs(args.players, args.roles, args.p_approve, args.p_fail)
+    start = time.perf_counter()
+    summaries = run_tournament(configs, args.games, args.chunk, args.workers, args.seed)
+    elapsed = time.perf_counter() - start
+
+    table = PrettyTable(['players', 'roles', 'games', 'good win', 'evil win', 'assassin hit', 'quests', 'rounds'])
+    for s in summaries:
+        table.add_row([s['n_players'],
+                       s['roles'] or '-',
+                       s['n_games'],
+                       f"{s['good_win_rate']:.2%}",
+                       f"{s['evil_win_rate']:.2%}",
+                       f"{s['assassin_hit_rate']:.2%}",
+                       f"{s['mean_quests']:.2f}",
+                       f"{s['mean_rounds']:.2f}"])
+    print(table)
+    n_total = sum(s['n_games'] for s in summaries)
+    print(f'{n_total} games in {elapsed:.1f}s with {args.workers or os.cpu_count()} workers')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'seed': args.seed, 'chunk': args.chunk, 'results': summaries}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()